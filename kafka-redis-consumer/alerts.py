@@ -0,0 +1,97 @@
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+
+# Mesmos padrões usados pelo serviço Spark quando a configuração do silo não está disponível
+DEFAULT_LIMITS = {"temperature": 40.0, "humidity": 80.0}
+LIMIT_FIELDS = {"temperature": "maxTemperature", "humidity": "maxHumidity"}
+
+class ThresholdAlerts:
+    """
+    Avalia cada leitura contra os limites do silo do dispositivo (maxTemperature e
+    maxHumidity), sem esperar o ciclo de 5 minutos do Spark.
+
+    Os limites ficam em cache e são atualizados por uma thread de fundo, nunca por
+    mensagem; a primeira carga também roda nessa thread, e o consumidor espera
+    'ready' antes de consumir (no motor asyncio, fora do loop). Para evitar rajadas de alertas, uma métrica só entra em alerta depois
+    de ficar acima do limite por ALERT_DEBOUNCE_SECONDS, e só sai quando cai abaixo
+    do limite menos a histerese da métrica. Apenas as transições geram eventos.
+    """
+    def __init__(self):
+        self.silo_api_url = os.getenv('SILO_API_URL', 'http://nest-api:3000/silos')
+        self.device_to_silo = json.loads(os.getenv('DEVICE_TO_SILO', '{"0C4EA065A598": 1}'))
+        self.channel = os.getenv('ALERTS_CHANNEL', 'device-alerts')
+        self.refresh_interval = int(os.getenv('SILO_CONFIG_REFRESH_SECONDS', 60))
+        self.debounce = float(os.getenv('ALERT_DEBOUNCE_SECONDS', 10))
+        self.hysteresis = {
+            "temperature": float(os.getenv('ALERT_HYSTERESIS_TEMPERATURE', 1.0)),
+            "humidity": float(os.getenv('ALERT_HYSTERESIS_HUMIDITY', 3.0)),
+        }
+        self.limits = {}  # silo_id -> {métrica: limite}
+        self.states = {}  # (device_id, métrica) -> [em alerta, acima do limite desde]
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+        self.ready = threading.Event()  # Sinalizado após a primeira carga dos limites
+        threading.Thread(target=self._refresh_loop, daemon=True).start()
+
+    def refresh(self):
+        """Recarrega os limites de todos os silos mapeados; em caso de erro mantém os anteriores."""
+        for silo_id in set(self.device_to_silo.values()):
+            try:
+                with urllib.request.urlopen(f"{self.silo_api_url}/{silo_id}", timeout=5) as res:
+                    config = json.loads(res.read())
+                self.limits[silo_id] = {
+                    metric: float(config[field]) for metric, field in LIMIT_FIELDS.items() if config.get(field) is not None
+                }
+            except Exception as e:
+                self.logger.error(f"Erro ao atualizar limites do silo #{silo_id}: {repr(e)}. Mantendo os anteriores.")
+
+    def _refresh_loop(self):
+        while True:
+            self.refresh()
+            self.ready.set()
+            time.sleep(self.refresh_interval)
+
+    def evaluate(self, device_id, timestamp, payload):
+        """Atualiza o estado das métricas do dispositivo e retorna os eventos gerados pela leitura."""
+        silo_id = self.device_to_silo.get(device_id)
+        if silo_id is None:
+            return []
+        limits = self.limits.get(silo_id) or DEFAULT_LIMITS
+        events = []
+        with self.lock:
+            for metric, limit in limits.items():
+                try:
+                    value = float(payload.get(metric))
+                except (TypeError, ValueError):
+                    continue
+                state = self.states.setdefault((device_id, metric), [False, None])
+                if not state[0]:
+                    if value <= limit:
+                        state[1] = None
+                        continue
+                    if state[1] is None:
+                        state[1] = timestamp
+                    if timestamp - state[1] >= self.debounce:
+                        state[0] = True
+                        events.append(self._event("raised", device_id, silo_id, metric, value, limit, timestamp))
+                elif value < limit - self.hysteresis.get(metric, 0.0):
+                    state[0], state[1] = False, None
+                    events.append(self._event("resolved", device_id, silo_id, metric, value, limit, timestamp))
+        return events
+
+    @staticmethod
+    def _event(status, device_id, silo_id, metric, value, limit, timestamp):
+        return json.dumps({
+            "device_id": device_id,
+            "silo_id": silo_id,
+            "metric": metric,
+            "status": status,
+            "value": value,
+            "limit": limit,
+            "timestamp": timestamp,
+        })
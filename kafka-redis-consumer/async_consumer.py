@@ -0,0 +1,249 @@
+import asyncio
+import os
+import struct
+import redis
+import redis.asyncio as aioredis
+from aiokafka import AIOKafkaConsumer, ConsumerRebalanceListener, TopicPartition
+from consumer import KafkaRedisConsumer
+
+class AsyncPartitionRebalanceListener(ConsumerRebalanceListener):
+    """Versão asyncio do PartitionRebalanceListener."""
+    def __init__(self, connector):
+        self.connector = connector
+
+    async def on_partitions_revoked(self, revoked):
+        partitions = {tp.partition for tp in revoked}
+        if partitions:
+            self.connector.logger.info(f"Partições revogadas: {sorted(partitions)}. Gravando lotes pendentes...")
+            await self.connector.flush_partitions_async(partitions)
+
+    async def on_partitions_assigned(self, assigned):
+        self.connector.logger.info(f"Partições atribuídas: {sorted(tp.partition for tp in assigned)}")
+        if self.connector.transactional and assigned:
+            await self.connector.seek_to_stored_offsets_async(assigned)
+
+class AsyncKafkaRedisConsumer(KafkaRedisConsumer):
+    """
+    Motor asyncio do conector (CONSUMER_ENGINE=async), com aiokafka e redis.asyncio.
+
+    O aiokafka busca as próximas mensagens em segundo plano enquanto os pipelines
+    do Redis são executados, e os flushes das partições rodam como tasks no mesmo
+    loop, limitados por ASYNC_MAX_IN_FLIGHT. Continua havendo no máximo um lote
+    em andamento por partição, então os offsets de cada partição são comitados em
+    ordem. Configuração, montagem dos itens e escritas no Redis são as mesmas do
+    KafkaRedisConsumer síncrono, que continua disponível para comparação.
+
+    Chamadas bloqueantes (busca de schemas Avro no schema-registry e a espera
+    pela primeira carga dos limites de alerta) rodam em threads via
+    asyncio.to_thread, nunca no loop de eventos.
+    """
+    topic_partition = TopicPartition
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Os flushes rodam como tasks no loop: o pool de threads do motor síncrono não é usado
+        self.executor.shutdown(wait=False)
+        self.executor = None
+        self.max_in_flight = int(os.getenv('ASYNC_MAX_IN_FLIGHT', 8))
+        self.flush_slots = None  # Criado dentro do loop de eventos
+
+    async def _connect_redis_async(self):
+        """Conecta ao Redis (cliente asyncio) com retentativas."""
+        while True:
+            try:
+                client = aioredis.Redis(host=self.redis_host, port=6379, password="1234", db=0, decode_responses=True)
+                await client.ping()
+                self.logger.info("Conectado ao Redis com sucesso!")
+                return client
+            except redis.exceptions.ConnectionError as e:
+                self.logger.error(f"Erro ao conectar ao Redis: {e}. Tentando novamente em 5s...")
+                await asyncio.sleep(5)
+
+    async def _connect_kafka_async(self):
+        """Conecta ao Kafka (aiokafka) com retentativas."""
+        while True:
+            consumer = AIOKafkaConsumer(
+                bootstrap_servers=self.kafka_broker,
+                auto_offset_reset='latest',
+                enable_auto_commit=False,
+                group_id='kafka-redis-consumer-group',
+                max_poll_records=self.max_batch_size
+            )
+            consumer.subscribe([self.kafka_topic], listener=AsyncPartitionRebalanceListener(self))
+            try:
+                await consumer.start()
+                self.logger.info("Conectado ao Kafka com sucesso!")
+                return consumer
+            except Exception as e:
+                await consumer.stop()
+                self.logger.error(f"Erro ao conectar ao Kafka: {e}. Tentando novamente em 5s...")
+                await asyncio.sleep(5)
+
+    def _get_schema(self, schema_id):
+        """
+        Apenas o cache: os schemas ausentes já foram buscados (fora do loop) por
+        _prefetch_schemas_async, e um schema que não pôde ser carregado torna a
+        mensagem inválida.
+        """
+        schema = self.schemas.get(schema_id)
+        if schema is None:
+            raise ValueError(f"Schema Avro #{schema_id} indisponível")
+        return schema
+
+    async def _prefetch_schemas_async(self, records):
+        """Busca em threads os schemas Avro ainda fora do cache usados pelas mensagens recebidas."""
+        schema_ids = {
+            struct.unpack('>I', message.value[1:5])[0]
+            for messages in records.values() for message in messages
+            if message.value and len(message.value) > 5 and message.value[0] == 0
+        }
+        for schema_id in schema_ids - self.schemas.keys():
+            try:
+                await asyncio.to_thread(super()._get_schema, schema_id)
+            except ValueError as e:
+                self.logger.warning(f"{e}. As mensagens com esse schema serão puladas.")
+
+    async def seek_to_stored_offsets_async(self, assigned):
+        """Posiciona as partições atribuídas no offset gravado junto com os dados no Redis."""
+        tps = list(assigned)
+        stored = await self.redis_client.mget([self._offset_key(tp.partition) for tp in tps])
+        for tp, offset in zip(tps, stored):
+            if offset is not None:
+                self.consumer.seek(tp, int(offset))
+                self.logger.info(f"Partição {tp.partition} retomada do offset {offset} salvo no Redis.")
+
+    async def _flush_transactional_async(self, partition, items, commit_offset):
+        """Mesma transação de _flush_transactional (WATCH + MULTI/EXEC), com o cliente asyncio."""
+        offset_key = self._offset_key(partition)
+        async with self.redis_client.pipeline() as pipe:
+            while True:
+                try:
+                    await pipe.watch(offset_key)
+                    stored = await pipe.get(offset_key)
+                    stored = int(stored) if stored is not None else -1
+                    if stored >= commit_offset:
+                        await pipe.unwatch()
+                        self.logger.info(f"Lote da partição {partition} já aplicado (offset {stored}). Ignorado.")
+                        return None
+                    pending = [item for item in items if item['offset'] >= stored]
+                    pipe.multi()
+                    device_count = self._queue_writes(pipe, pending) if pending else 0
+                    pipe.set(offset_key, commit_offset)
+                    await pipe.execute()
+                    return device_count
+                except redis.exceptions.WatchError:
+                    continue
+
+    async def _flush_partition_async(self, partition, items, commit_offset):
+        """Task de flush de uma partição; o semáforo limita os pipelines simultâneos."""
+        async with self.flush_slots:
+            if self.transactional:
+                device_count = await self._flush_transactional_async(partition, items, commit_offset)
+                if device_count is None:
+                    return
+            else:
+                pipe = self.redis_client.pipeline()
+                device_count = self._queue_writes(pipe, items)
+                await pipe.execute()
+        self.logger.info(f"Lote de {len(items)} mensagens da partição {partition} salvo ({device_count} dispositivos, lag {self.lag})")
+
+    def _submit_flush(self, partition, items, commit_offset):
+        return asyncio.ensure_future(self._flush_partition_async(partition, items, commit_offset))
+
+    async def _collect_completed_async(self, wait=False, partitions=None):
+        """Versão asyncio de _collect_completed: um único commit para os lotes concluídos."""
+        offsets = {}
+        for partition, (task, items, commit_offset) in list(self.in_flight.items()):
+            if partitions is not None and partition not in partitions:
+                continue
+            if wait:
+                await asyncio.wait([task])
+            elif not task.done():
+                continue
+            del self.in_flight[partition]
+            error = task.exception()
+            if error is None:
+                offsets[self.topic_partition(self.kafka_topic, partition)] = commit_offset
+            else:
+                self.logger.error(f"Erro ao gravar lote da partição {partition}: {repr(error)}. As mensagens serão reprocessadas.")
+                self.batches[partition] = items + self.batches.get(partition, [])
+                if isinstance(error, redis.exceptions.ConnectionError):
+                    self.redis_client = await self._connect_redis_async()
+        if offsets and not self.transactional:
+            await self.consumer.commit(offsets)
+            self.logger.info(f"Offsets de {len(offsets)} partições comitados no Kafka.")
+
+    async def flush_partitions_async(self, partitions):
+        """Grava e comita tudo o que está pendente nas partições (usado no rebalanceamento)."""
+        await self._collect_completed_async(wait=True, partitions=partitions)
+        for partition in partitions:
+            self._dispatch(partition, force=True)
+        await self._collect_completed_async(wait=True, partitions=partitions)
+        for partition in partitions:
+            self.batches.pop(partition, None)
+            self.next_offsets.pop(partition, None)
+            self.last_flush_time.pop(partition, None)
+        self.paused = {tp for tp in self.paused if tp.partition not in partitions}
+
+    async def _update_lag_async(self):
+        lag = 0
+        assignment = self.consumer.assignment()
+        for tp in assignment:
+            highwater = self.consumer.highwater(tp)
+            if highwater is not None:
+                lag += max(0, highwater - await self.consumer.position(tp))
+        self._set_lag(lag, len(assignment))
+
+    async def _trim_history_async(self):
+        trimmed = self._take_devices_to_trim()
+        if trimmed is None:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            self._queue_trim(pipe, trimmed)
+            await pipe.execute()
+            if trimmed:
+                self.logger.info(f"Histórico de {len(trimmed)} dispositivos limpo.")
+        except Exception as e:
+            self.logger.error(f"Erro ao limpar histórico: {repr(e)}. Nova tentativa no próximo ciclo.")
+            with self.trim_lock:
+                self.devices_to_trim |= trimmed
+
+    async def _publish_stats_async(self):
+        mapping = self._stats_mapping()
+        if mapping is None:
+            return
+        try:
+            await self.redis_client.hset("consumer:stats", mapping=mapping)
+        except Exception as e:
+            self.logger.error(f"Erro ao publicar estatísticas: {repr(e)}")
+
+    async def run_async(self):
+        self.flush_slots = asyncio.Semaphore(self.max_in_flight)
+        self.redis_client = await self._connect_redis_async()
+        self.consumer = await self._connect_kafka_async()
+        if self.alerts:
+            await asyncio.to_thread(self.alerts.ready.wait)
+
+        while True:
+            try:
+                records = await self.consumer.getmany(
+                    timeout_ms=int(self.flush_interval * 1000),
+                    max_records=self.max_batch_size
+                )
+                await self._prefetch_schemas_async(records)
+                self._add_records(records)
+                await self._update_lag_async()
+                await self._collect_completed_async()
+                for partition in list(self.batches):
+                    self._dispatch(partition)
+                self._apply_backpressure()
+                await self._trim_history_async()
+                await self._publish_stats_async()
+
+            except Exception as e:
+                self.logger.error(f"Erro inesperado no laço principal: {e}. O consumidor continuará.")
+                await asyncio.sleep(5)
+
+    def run(self):
+        asyncio.run(self.run_async())
@@ -1,10 +1,27 @@
+import io
 import json
+import math
 import os
+import re
+import struct
+import threading
 import time
-from kafka import KafkaConsumer, TopicPartition
+import urllib.error
+import urllib.request
+import zlib
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
+import fastavro
+from kafka import KafkaConsumer, TopicPartition, ConsumerRebalanceListener
+from kafka.structs import OffsetAndMetadata
 from kafka.errors import KafkaError
 import redis
 import logging
+from alerts import ThresholdAlerts
+
+try:
+    import zstandard
+except ImportError:  # Opcional: só é necessário com HISTORY_COMPRESSION=zstd
+    zstandard = None
 
 # --- Configuração do Logging ---
 logging.basicConfig(
@@ -13,17 +30,174 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
+# Layout compacto do histórico: registros de largura fixa (timestamp float64 + temperatura,
+# umidade e mq_rs float32, little-endian), concatenados em uma chave por dispositivo e bucket
+# de tempo. Deve ser o mesmo formato lido por spark/timeseries_reader.py.
+TS_RECORD = struct.Struct('<dfff')
+TS_FIELDS = ('temperature', 'humidity', 'mq_rs')
+
+# Compressão dos membros do histórico: um byte de cabeçalho indica o codec (JSON começa com '{').
+# O dicionário pré-definido contém a estrutura repetida das mensagens e precisa ser o mesmo
+# usado por decode_member em spark/timeseries_reader.py.
+CODEC_ZLIB = b'\x01'
+CODEC_ZSTD = b'\x02'
+HISTORY_DICTIONARY = (
+    b'{"device_id": "0C4EA065A598", "payload": {"temperature": 24.5, "humidity": 65.2, '
+    b'"mq_rs": 1234.5}, "timestamp": 1700000000}'
+)
+
+class HistoryCodec:
+    """
+    Codec dos membros do histórico (e, opcionalmente, do Pub/Sub).
+
+    - 'zlib': deflate sem cabeçalho com o dicionário pré-definido (zdict), que
+      evita pagar pelas chaves repetidas em cada mensagem curta.
+    - 'zstd': zstandard com um dicionário treinado (HISTORY_ZSTD_DICT, gerado com
+      'zstd --train' a partir de membros reais) ou, sem ele, o dicionário pré-definido.
+    """
+    def __init__(self, name, zstd_dict_path=None):
+        self.name = name
+        self.local = threading.local()  # Compressores zstd não são thread-safe
+        self.zstd_dict = None
+        if name == 'zstd':
+            if zstandard is None:
+                logging.error("HISTORY_COMPRESSION=zstd requer o pacote 'zstandard'. Usando zlib.")
+                self.name = 'zlib'
+            elif zstd_dict_path:
+                with open(zstd_dict_path, 'rb') as f:
+                    self.zstd_dict = zstandard.ZstdCompressionDict(f.read())
+            else:
+                self.zstd_dict = zstandard.ZstdCompressionDict(HISTORY_DICTIONARY, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+
+    def encode(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self.name == 'zstd':
+            compressor = getattr(self.local, 'compressor', None)
+            if compressor is None:
+                # Frames sem magic, tamanho, checksum e id do dicionário: o dicionário é fixo nos dois lados
+                params = zstandard.ZstdCompressionParameters.from_level(
+                    3, format=zstandard.FORMAT_ZSTD1_MAGICLESS, write_content_size=False,
+                    write_checksum=False, write_dict_id=False
+                )
+                compressor = self.local.compressor = zstandard.ZstdCompressor(dict_data=self.zstd_dict, compression_params=params)
+            return CODEC_ZSTD + compressor.compress(data)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15, zdict=HISTORY_DICTIONARY)
+        return CODEC_ZLIB + compressor.compress(data) + compressor.flush()
+
+# Rollups incrementais: para cada métrica acumula count/sum/sumsq e mantém min/max no hash do bucket.
+# ARGV = [métrica, count, sum, sumsq, min, max]* + [ttl]
+ROLLUP_SCRIPT = """
+local key = KEYS[1]
+for i = 1, #ARGV - 1, 6 do
+  local m = ARGV[i]
+  redis.call('HINCRBY', key, m .. ':count', ARGV[i + 1])
+  redis.call('HINCRBYFLOAT', key, m .. ':sum', ARGV[i + 2])
+  redis.call('HINCRBYFLOAT', key, m .. ':sumsq', ARGV[i + 3])
+  local cur_min = redis.call('HGET', key, m .. ':min')
+  if not cur_min or tonumber(ARGV[i + 4]) < tonumber(cur_min) then
+    redis.call('HSET', key, m .. ':min', ARGV[i + 4])
+  end
+  local cur_max = redis.call('HGET', key, m .. ':max')
+  if not cur_max or tonumber(ARGV[i + 5]) > tonumber(cur_max) then
+    redis.call('HSET', key, m .. ':max', ARGV[i + 5])
+  end
+end
+redis.call('EXPIRE', key, ARGV[#ARGV])
+return 1
+"""
+
+# Leitura mínima dos campos de roteamento no modo passthrough (sem decodificar o JSON inteiro)
+DEVICE_ID_PATTERN = re.compile(rb'"device_id"\s*:\s*"([^"]*)"')
+TIMESTAMP_PATTERN = re.compile(rb'"timestamp"\s*:\s*(\d+)')
+
+def make_offset(offset):
+    """OffsetAndMetadata compatível com versões do kafka-python com e sem leader_epoch."""
+    if 'leader_epoch' in OffsetAndMetadata._fields:
+        return OffsetAndMetadata(offset, '', -1)
+    return OffsetAndMetadata(offset, '')
+
+class PartitionRebalanceListener(ConsumerRebalanceListener):
+    """Grava e comita o trabalho em andamento das partições antes de perdê-las."""
+    def __init__(self, connector):
+        self.connector = connector
+
+    def on_partitions_revoked(self, revoked):
+        partitions = {tp.partition for tp in revoked}
+        if partitions:
+            self.connector.logger.info(f"Partições revogadas: {sorted(partitions)}. Gravando lotes pendentes...")
+            self.connector.flush_partitions(partitions)
+
+    def on_partitions_assigned(self, assigned):
+        self.connector.logger.info(f"Partições atribuídas: {sorted(tp.partition for tp in assigned)}")
+        if self.connector.transactional and assigned:
+            self.connector.seek_to_stored_offsets(assigned)
+
 class KafkaRedisConsumer:
-    def __init__(self, batch_size=10, flush_interval=5):
-        self.batch_size = batch_size
-        self.flush_interval = flush_interval
+    # Tipo de TopicPartition do cliente Kafka usado (o motor asyncio usa o do aiokafka)
+    topic_partition = TopicPartition
+
+    def __init__(self, min_batch_size=10, max_batch_size=5000, flush_interval=1.0, min_flush_interval=0.1):
+        # Tamanho do lote e intervalo de flush se adaptam ao lag do consumidor:
+        # lotes grandes para recuperar um backlog, lotes pequenos e rápidos quando o tópico está calmo
+        self.min_batch_size = int(os.getenv('MIN_BATCH_SIZE', min_batch_size))
+        self.max_batch_size = int(os.getenv('MAX_BATCH_SIZE', max_batch_size))
+        self.max_flush_interval = float(os.getenv('FLUSH_INTERVAL', flush_interval))
+        self.min_flush_interval = float(os.getenv('MIN_FLUSH_INTERVAL', min_flush_interval))
+        self.batch_size = self.min_batch_size
+        self.flush_interval = self.min_flush_interval
+        self.lag = 0
         self.batches = {}  # Dicionário para lotes por partição
-        self.last_flush_time = time.time()
+        self.next_offsets = {}  # Próximo offset a comitar por partição (inclui mensagens inválidas)
+        self.last_flush_time = {}  # Último flush por partição
+
+        # Workers que gravam no Redis em paralelo, no máximo um lote em andamento por partição
+        self.partition_workers = int(os.getenv('PARTITION_WORKERS', 4))
+        self.executor = ThreadPoolExecutor(max_workers=self.partition_workers, thread_name_prefix="partition")
+        self.in_flight = {}  # partição -> (future, itens, offset a comitar)
+        self.paused = set()
         
         # --- Configurações ---
         self.kafka_broker = os.getenv('KAFKA_BROKER', 'redpanda:29092')
         self.kafka_topic = os.getenv('KAFKA_TOPIC', 'iot-data')
         self.redis_host = os.getenv('REDIS_HOST', 'redis')
+        self.schema_registry_url = os.getenv('SCHEMA_REGISTRY_URL', 'http://schema-registry:8081')
+        self.schemas = {}  # Cache de schemas Avro por id do schema-registry
+        # Tentativas para erros transitórios do schema-registry (4xx nunca é retentado)
+        self.schema_retries = max(1, int(os.getenv('SCHEMA_REGISTRY_RETRIES', 3)))
+        self.schema_retry_delay = float(os.getenv('SCHEMA_REGISTRY_RETRY_DELAY', 2))
+        # Passthrough: grava os bytes originais da mensagem no Redis sem decodificar/recodificar o JSON
+        self.passthrough = os.getenv('CONSUMER_PASSTHROUGH', 'false').lower() == 'true'
+        # PUBLISH em lote: um único array JSON por dispositivo e lote, em vez de uma mensagem por leitura
+        self.batch_publish = os.getenv('CONSUMER_BATCH_PUBLISH', 'false').lower() == 'true'
+        # Compressão dos membros do histórico ('none', 'zlib' ou 'zstd') e, opcionalmente, do PUBLISH
+        compression = os.getenv('HISTORY_COMPRESSION', 'none')
+        self.codec = HistoryCodec(compression, os.getenv('HISTORY_ZSTD_DICT')) if compression != 'none' else None
+        self.compress_publish = self.codec is not None and os.getenv('COMPRESS_PUBLISH', 'false').lower() == 'true'
+        # Sink transacional: dados e offset da partição gravados no mesmo MULTI/EXEC do Redis,
+        # sem commit no Kafka; ao receber uma partição o consumidor retoma do offset salvo no Redis
+        self.transactional = os.getenv('CONSUMER_TRANSACTIONAL', 'false').lower() == 'true'
+        # Retenção do histórico e cadência da limpeza (ZREMRANGEBYSCORE)
+        self.history_retention = int(os.getenv('HISTORY_RETENTION_SECONDS', 5 * 3600))
+        self.trim_interval = int(os.getenv('TRIM_INTERVAL_SECONDS', 60))
+        # Layout do histórico: 'zset' (JSON em Sorted Set, lido pela API), 'bucketed' (compacto) ou 'both'
+        self.history_layout = os.getenv('HISTORY_LAYOUT', 'zset')
+        self.bucket_seconds = int(os.getenv('HISTORY_BUCKET_SECONDS', 3600))
+        # Níveis de rollup: nome -> (tamanho do bucket, retenção) em segundos. Os rollups
+        # precisam do payload decodificado, então no passthrough só rodam se pedidos explicitamente
+        self.rollups_enabled = os.getenv('ROLLUPS_ENABLED', 'false' if self.passthrough else 'true').lower() == 'true'
+        self.rollup_tiers = {
+            "1m": (60, int(os.getenv('ROLLUP_1M_RETENTION_SECONDS', 2 * 24 * 3600))),
+            "1h": (3600, int(os.getenv('ROLLUP_1H_RETENTION_SECONDS', 90 * 24 * 3600))),
+        }
+        self.rollup_script = None
+        # Alertas de limite por leitura, publicados no mesmo pipeline (canal ALERTS_CHANNEL)
+        self.alerts = ThresholdAlerts() if os.getenv('ALERTS_ENABLED', 'false').lower() == 'true' else None
+        self.devices_to_trim = set()
+        self.trim_lock = threading.Lock()
+        self.last_trim_time = 0.0
+        self.stats_interval = 5
+        self.last_stats_time = 0.0
         
         self.consumer = None
         self.redis_client = None
@@ -47,99 +221,510 @@ class KafkaRedisConsumer:
         while True:
             try:
                 consumer = KafkaConsumer(
-                    self.kafka_topic,
                     bootstrap_servers=[self.kafka_broker],
                     auto_offset_reset='latest',
                     enable_auto_commit=False, 
                     group_id='kafka-redis-consumer-group',
-                    consumer_timeout_ms=1000 # Evita que o loop fique bloqueado
+                    max_poll_records=self.max_batch_size
                 )
+                consumer.subscribe([self.kafka_topic], listener=PartitionRebalanceListener(self))
                 self.logger.info("Conectado ao Kafka com sucesso!")
                 return consumer
             except Exception as e:
                 self.logger.error(f"Erro ao conectar ao Kafka: {e}. Tentando novamente em 5s...")
                 time.sleep(5)
 
-    def _process_batch(self):
-        """Processa os lotes usando Sorted Sets e limpa dados antigos."""
-        if not self.batches:
-            return
+    def _fetch_schema(self, schema_id):
+        """
+        Uma tentativa de busca do schema Avro no schema-registry. Respostas 4xx
+        (id desconhecido) são permanentes e viram ValueError, para que a mensagem
+        seja pulada como inválida em vez de travar o consumidor.
+        """
+        try:
+            with urllib.request.urlopen(f"{self.schema_registry_url}/schemas/ids/{schema_id}", timeout=10) as res:
+                schema_str = json.loads(res.read())['schema']
+        except urllib.error.HTTPError as e:
+            if 400 <= e.code < 500:
+                raise ValueError(f"Schema Avro #{schema_id} não encontrado no schema-registry ({e.code})") from e
+            raise
+        schema = fastavro.parse_schema(json.loads(schema_str))
+        self.schemas[schema_id] = schema
+        self.logger.info(f"Schema Avro #{schema_id} carregado do schema-registry.")
+        return schema
 
-        total_messages = 0
-        # Timestamp de 5 horas atrás para o comando de limpeza
-        five_hours_ago_ts = int(time.time()) - (5 * 3600)
+    def _get_schema(self, schema_id):
+        """
+        Busca (com cache) o schema Avro do produtor. Erros transitórios são
+        retentados até SCHEMA_REGISTRY_RETRIES vezes; esgotadas as tentativas, a
+        mensagem é tratada como inválida (ValueError).
+        """
+        schema = self.schemas.get(schema_id)
+        if schema is not None:
+            return schema
+        for attempt in range(1, self.schema_retries + 1):
+            try:
+                return self._fetch_schema(schema_id)
+            except ValueError:
+                raise
+            except Exception as e:
+                self.logger.error(f"Erro ao buscar schema #{schema_id} (tentativa {attempt}/{self.schema_retries}): {e}")
+                if attempt < self.schema_retries:
+                    time.sleep(self.schema_retry_delay)
+        raise ValueError(f"Schema Avro #{schema_id} indisponível após {self.schema_retries} tentativas")
+
+    def _deserialize(self, raw_value):
+        """
+        Decodifica o valor da mensagem. Mensagens no wire format do schema-registry
+        (byte mágico 0 + id do schema) são lidas como Avro; as demais como JSON.
+        """
+        if len(raw_value) > 5 and raw_value[0] == 0:
+            schema_id = struct.unpack('>I', raw_value[1:5])[0]
+            record = fastavro.schemaless_reader(io.BytesIO(raw_value[5:]), self._get_schema(schema_id))
+            payload = {field: record[field] for field in ('temperature', 'humidity', 'mq_rs') if record.get(field) is not None}
+            for key, value in record.get('extra', {}).items():
+                payload[key] = json.loads(value)
+            return {
+                "device_id": record['device_id'],
+                "payload": payload,
+                "timestamp": record['timestamp']
+            }
+        return json.loads(raw_value.decode('utf-8'))
+
+    def _passthrough_item(self, message):
+        """
+        Monta o item do lote sem decodificar o valor: device_id e timestamp vêm
+        dos headers da mensagem, da chave ou de uma leitura mínima dos bytes.
+        """
+        headers = dict(message.headers or [])
+        raw_value = message.value
+
+        device_id = headers.get('device_id') or message.key
+        if not device_id:
+            match = DEVICE_ID_PATTERN.search(raw_value)
+            device_id = match.group(1) if match else b'unknown'
+
+        timestamp = headers.get('timestamp')
+        if timestamp is None:
+            # O timestamp da mensagem é o último campo; o payload pode ter um 'timestamp' próprio
+            matches = TIMESTAMP_PATTERN.findall(raw_value)
+            timestamp = matches[-1] if matches else message.timestamp // 1000
+
+        return {
+            "device_id": device_id.decode('utf-8'),
+            "timestamp": int(timestamp),
+            "member": raw_value,
+            # Sem o payload isolado, o último estado guarda a mensagem original
+            "state": {"message": raw_value, "timestamp": int(timestamp)},
+            "offset": message.offset
+        }
+
+    def _decoded_item(self, message):
+        """Monta o item do lote a partir da mensagem decodificada (JSON ou Avro)."""
+        message_value = self._deserialize(message.value)
+        payload = message_value.get('payload', {})
+        timestamp = message_value.get('timestamp', int(time.time()))
+        return {
+            "device_id": message_value.get('device_id', 'unknown'),
+            "timestamp": timestamp,
+            # Serializado uma única vez: o mesmo texto vai para o histórico e para o PUBLISH
+            "member": json.dumps(message_value),
+            "state": {"payload": json.dumps(payload), "timestamp": timestamp},
+            "payload": payload,
+            "offset": message.offset
+        }
+
+    def _to_item(self, message):
+        # Mensagens Avro (byte mágico 0) sempre precisam ser decodificadas para JSON
+        if self.passthrough and message.value[:1] != b'\x00':
+            return self._passthrough_item(message)
+        return self._decoded_item(message)
+
+    def _queue_writes(self, pipe, items):
+        """
+        Enfileira no pipeline as escritas de uma lista de itens, agrupadas por
+        dispositivo: um ZADD com todos os membros, um HSET com o estado mais
+        recente e os PUBLISH (um por mensagem ou um único em lote).
+        """
+        by_device = {}
+        for item in items:
+            by_device.setdefault(item['device_id'], []).append(item)
+
+        for device_id, device_items in by_device.items():
+            if device_id and device_id != 'unknown':
+                with self.trim_lock:
+                    self.devices_to_trim.add(device_id)
+
+            if self.history_layout in ('zset', 'both'):
+                encode = self.codec.encode if self.codec else (lambda member: member)
+                pipe.zadd(f"device:history:{device_id}", {encode(item['member']): float(item['timestamp']) for item in device_items})
+            if self.history_layout in ('bucketed', 'both'):
+                self._queue_bucketed(pipe, device_id, device_items)
+            if self.rollups_enabled:
+                self._queue_rollups(pipe, device_id, device_items)
+            # Apenas o estado mais recente do lote precisa ser gravado; no empate de
+            # timestamp vale a última mensagem consumida, como nas escritas por mensagem
+            newest = max(reversed(device_items), key=lambda item: item['timestamp'])
+            pipe.hset(f"device:last_state:{device_id}", mapping=newest['state'])
+            if self.alerts:
+                self._queue_alerts(pipe, device_id, device_items)
+
+            channel = f"device-updates:{device_id}"
+            encode = self.codec.encode if self.compress_publish else (lambda member: member)
+            if self.batch_publish:
+                pipe.publish(channel, encode(self._join_members([item['member'] for item in device_items])))
+            else:
+                for item in device_items:
+                    pipe.publish(channel, encode(item['member']))
+
+        # Índice de dispositivos por última leitura, usado pelo Spark no lugar de KEYS.
+        # GT: uma leitura atrasada não faz o índice voltar no tempo
+        last_seen = {
+            device_id: max(item['timestamp'] for item in device_items)
+            for device_id, device_items in by_device.items() if device_id and device_id != 'unknown'
+        }
+        if last_seen:
+            pipe.zadd("devices:last_seen", last_seen, gt=True)
+        return len(by_device)
+
+    def _queue_alerts(self, pipe, device_id, device_items):
+        """
+        Avalia as leituras em ordem de timestamp e publica as transições de alerta.
+        Os eventos ficam guardados no item, então uma transação refeita ou um lote
+        reenfileirado publica os mesmos eventos sem reavaliar (e sem perdê-los).
+        """
+        for item in sorted(device_items, key=lambda item: item['timestamp']):
+            if 'alerts' not in item:
+                item['alerts'] = self.alerts.evaluate(device_id, item['timestamp'], self._item_payload(item))
+            for event in item['alerts']:
+                pipe.publish(self.alerts.channel, event)
+
+    @staticmethod
+    def _packed_value(payload, field):
+        try:
+            return float(payload.get(field))
+        except (TypeError, ValueError):
+            return float('nan')
 
+    @staticmethod
+    def _item_payload(item):
+        """
+        Payload da leitura como dict, para layout compacto, rollups e alertas.
+        Um payload que não é objeto JSON (lista, número ou texto inválido) vira {}:
+        a mensagem continua sendo gravada no histórico e só fica fora dos agregados,
+        em vez de fazer o lote inteiro da partição falhar a cada tentativa.
+        """
+        payload = item.get('payload')
         try:
+            if payload is None:
+                # Modo passthrough: o payload só é lido quando o layout compacto ou os rollups precisam dele
+                payload = json.loads(item['member']).get('payload', {})
+            if isinstance(payload, (str, bytes)):
+                payload = json.loads(payload)
+        except (ValueError, UnicodeDecodeError, AttributeError):
+            payload = None
+        if not isinstance(payload, dict):
+            payload = {}
+        item['payload'] = payload
+        return payload
+
+    def _queue_rollups(self, pipe, device_id, device_items):
+        """
+        Atualiza os rollups de 1 minuto e 1 hora do dispositivo no mesmo pipeline.
+        O lote é pré-agregado em Python, então cada bucket recebe uma única chamada do script.
+        """
+        if self.rollup_script is None:
+            self.rollup_script = self.redis_client.register_script(ROLLUP_SCRIPT)
+
+        for tier, (bucket_seconds, retention) in self.rollup_tiers.items():
+            buckets = {}
+            for item in device_items:
+                payload = self._item_payload(item)
+                timestamp = int(item['timestamp'])
+                stats = buckets.setdefault(timestamp - timestamp % bucket_seconds, {})
+                for field in TS_FIELDS:
+                    value = self._packed_value(payload, field)
+                    if math.isnan(value):
+                        continue
+                    acc = stats.get(field)
+                    if acc is None:
+                        stats[field] = [1, value, value * value, value, value]
+                    else:
+                        acc[0] += 1
+                        acc[1] += value
+                        acc[2] += value * value
+                        acc[3] = min(acc[3], value)
+                        acc[4] = max(acc[4], value)
+
+            for bucket, stats in buckets.items():
+                if not stats:
+                    continue
+                args = []
+                for field, acc in stats.items():
+                    args.extend([field, *acc])
+                args.append(bucket + bucket_seconds + retention - int(time.time()))
+                # EVALSHA direto no pipeline: o script é carregado no execute() (cliente síncrono ou asyncio)
+                pipe.scripts.add(self.rollup_script)
+                pipe.evalsha(self.rollup_script.sha, 1, f"device:rollup:{tier}:{device_id}:{bucket}", *args)
+
+    def _queue_bucketed(self, pipe, device_id, device_items):
+        """
+        Acrescenta (APPEND) os registros empacotados em device:ts:{device_id}:{bucket}.
+        A retenção é feita pelo EXPIRE de cada bucket, sem ZREMRANGEBYSCORE.
+        """
+        buckets = {}
+        for item in device_items:
+            payload = self._item_payload(item)
+            timestamp = float(item['timestamp'])
+            bucket = int(timestamp) - int(timestamp) % self.bucket_seconds
+            buckets.setdefault(bucket, []).append(
+                TS_RECORD.pack(timestamp, *(self._packed_value(payload, field) for field in TS_FIELDS))
+            )
+        for bucket, records in buckets.items():
+            key = f"device:ts:{device_id}:{bucket}"
+            pipe.append(key, b"".join(records))
+            pipe.expireat(key, bucket + self.bucket_seconds + self.history_retention)
+
+    @staticmethod
+    def _join_members(members):
+        """Junta os membros (str ou bytes) em um único array JSON sem decodificá-los."""
+        if isinstance(members[0], bytes):
+            return b"[" + b",".join(m if isinstance(m, bytes) else m.encode('utf-8') for m in members) + b"]"
+        return "[" + ",".join(m if isinstance(m, str) else m.decode('utf-8') for m in members) + "]"
+
+    def _take_devices_to_trim(self):
+        """
+        A limpeza do histórico roda na própria cadência (trim_interval), e não a cada lote:
+        o corte de retenção quase não se move entre lotes.
+        """
+        if time.time() - self.last_trim_time < self.trim_interval:
+            return None
+        with self.trim_lock:
+            trimmed, self.devices_to_trim = self.devices_to_trim, set()
+        self.last_trim_time = time.time()
+        return trimmed
+
+    def _queue_trim(self, pipe, trimmed):
+        cutoff_ts = int(time.time()) - self.history_retention
+        for device_id in trimmed:
+            # Remove todos os membros com score (timestamp) menor que o corte de retenção
+            pipe.zremrangebyscore(f"device:history:{device_id}", '-inf', cutoff_ts)
+        # Dispositivos sem leituras na janela de retenção saem do índice usado pelo Spark
+        pipe.zremrangebyscore("devices:last_seen", '-inf', cutoff_ts)
+
+    def _trim_history(self):
+        trimmed = self._take_devices_to_trim()
+        if trimmed is None:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            self._queue_trim(pipe, trimmed)
+            pipe.execute()
+            if trimmed:
+                self.logger.info(f"Histórico de {len(trimmed)} dispositivos limpo.")
+        except Exception as e:
+            self.logger.error(f"Erro ao limpar histórico: {repr(e)}. Nova tentativa no próximo ciclo.")
+            with self.trim_lock:
+                self.devices_to_trim |= trimmed
+
+    def _offset_key(self, partition):
+        return f"consumer:offset:{self.kafka_topic}:{partition}"
+
+    def seek_to_stored_offsets(self, assigned):
+        """Posiciona as partições atribuídas no offset gravado junto com os dados no Redis."""
+        tps = list(assigned)
+        stored = self.redis_client.mget([self._offset_key(tp.partition) for tp in tps])
+        for tp, offset in zip(tps, stored):
+            # Sem offset no Redis (primeira execução no modo transacional) vale o offset do grupo no Kafka
+            if offset is not None:
+                self.consumer.seek(tp, int(offset))
+                self.logger.info(f"Partição {tp.partition} retomada do offset {offset} salvo no Redis.")
+
+    def _flush_transactional(self, partition, items, commit_offset):
+        """
+        Grava o lote e o offset da partição em uma única transação (WATCH + MULTI/EXEC).
+        Mensagens com offset já aplicado são descartadas, então um lote reprocessado
+        não duplica membros do histórico, APPENDs nem rollups. Se outro consumidor
+        (por exemplo, um antigo dono da partição) gravar o offset entre o WATCH e o
+        EXEC, a transação é refeita com o novo offset.
+        """
+        offset_key = self._offset_key(partition)
+        with self.redis_client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(offset_key)
+                    stored = pipe.get(offset_key)
+                    stored = int(stored) if stored is not None else -1
+                    if stored >= commit_offset:
+                        pipe.unwatch()
+                        self.logger.info(f"Lote da partição {partition} já aplicado (offset {stored}). Ignorado.")
+                        return None
+                    pending = [item for item in items if item['offset'] >= stored]
+                    pipe.multi()
+                    device_count = self._queue_writes(pipe, pending) if pending else 0
+                    pipe.set(offset_key, commit_offset)
+                    pipe.execute()
+                    return device_count
+                except redis.exceptions.WatchError:
+                    continue
+
+    def _flush_partition(self, partition, items, commit_offset):
+        """Executado por um worker: grava o lote de uma partição com um pipeline próprio."""
+        if self.transactional:
+            device_count = self._flush_transactional(partition, items, commit_offset)
+            if device_count is None:
+                return
+        else:
             pipe = self.redis_client.pipeline()
-            
-            processed_devices = set() # Para saber quais históricos limpar
-
-            for partition, batch_list in self.batches.items():
-                for item in batch_list:
-                    message_value = item['value']
-                    device_id = message_value.get('device_id', 'unknown')
-                    payload = message_value.get('payload', {})
-                    timestamp = message_value.get('timestamp', int(time.time()))
-                    json_message = json.dumps(message_value)
-                    
-                    if device_id and device_id != 'unknown':
-                        processed_devices.add(device_id)
-                        
-                    pipe.zadd(f"device:history:{device_id}", {json.dumps(message_value): float(timestamp)})
-                    pipe.hset(f"device:last_state:{device_id}", mapping={
-                        "payload": json.dumps(payload),
-                        "timestamp": timestamp
-                    })
-                    pipe.publish(f"device-updates:{device_id}", json_message)
-                   
-                
-                total_messages += len(batch_list)
-
-            for device_id in processed_devices:
-                # Remove todos os membros com score (timestamp) menor que 5 horas atrás
-                pipe.zremrangebyscore(f"device:history:{device_id}", '-inf', five_hours_ago_ts)
+            device_count = self._queue_writes(pipe, items)
             pipe.execute()
-            self.logger.info(f"Lote de {total_messages} mensagens salvo")
+        self.logger.info(f"Lote de {len(items)} mensagens da partição {partition} salvo ({device_count} dispositivos, lag {self.lag})")
+
+    def _dispatch(self, partition, force=False):
+        """Envia o lote pendente da partição para um worker, se não houver outro em andamento."""
+        items = self.batches.get(partition)
+        if not items or partition in self.in_flight:
+            return
+        elapsed = time.time() - self.last_flush_time.get(partition, 0.0)
+        if not force and len(items) < self.batch_size and elapsed < self.flush_interval:
+            return
+        commit_offset = self.next_offsets[partition]
+        self.batches[partition] = []
+        self.last_flush_time[partition] = time.time()
+        self.in_flight[partition] = (self._submit_flush(partition, items, commit_offset), items, commit_offset)
+
+    def _submit_flush(self, partition, items, commit_offset):
+        return self.executor.submit(self._flush_partition, partition, items, commit_offset)
+
+    def _collect_completed(self, wait=False, partitions=None):
+        """
+        Comita, de uma vez, os offsets exatos das partições cujo lote foi gravado
+        com sucesso. Lotes com falha voltam para o início da fila da partição.
+        No modo transacional o offset já foi gravado no Redis e não há commit no Kafka.
+        """
+        offsets = {}
+        for partition, (future, items, commit_offset) in list(self.in_flight.items()):
+            if partitions is not None and partition not in partitions:
+                continue
+            if wait:
+                futures_wait([future])
+            elif not future.done():
+                continue
+            del self.in_flight[partition]
+            error = future.exception()
+            if error is None:
+                offsets[self.topic_partition(self.kafka_topic, partition)] = make_offset(commit_offset)
+            else:
+                self.logger.error(f"Erro ao gravar lote da partição {partition}: {repr(error)}. As mensagens serão reprocessadas.")
+                self.batches[partition] = items + self.batches.get(partition, [])
+                if isinstance(error, redis.exceptions.ConnectionError):
+                    self.redis_client = self._connect_redis()
+        if offsets and not self.transactional:
+            self.consumer.commit(offsets)
+            self.logger.info(f"Offsets de {len(offsets)} partições comitados no Kafka.")
+
+    def _apply_backpressure(self):
+        """Pausa partições cujo backlog local cresceu enquanto o worker ainda grava."""
+        for partition, items in self.batches.items():
+            tp = self.topic_partition(self.kafka_topic, partition)
+            if len(items) >= 2 * self.max_batch_size:
+                if tp not in self.paused:
+                    self.consumer.pause(tp)
+                    self.paused.add(tp)
+            elif tp in self.paused:
+                self.consumer.resume(tp)
+                self.paused.discard(tp)
+
+    def flush_partitions(self, partitions):
+        """Grava e comita tudo o que está pendente nas partições (usado no rebalanceamento)."""
+        self._collect_completed(wait=True, partitions=partitions)
+        for partition in partitions:
+            self._dispatch(partition, force=True)
+        self._collect_completed(wait=True, partitions=partitions)
+        for partition in partitions:
+            self.batches.pop(partition, None)
+            self.next_offsets.pop(partition, None)
+            self.last_flush_time.pop(partition, None)
+        self.paused = {tp for tp in self.paused if tp.partition not in partitions}
+
+    def _update_lag(self):
+        """
+        Calcula o lag (high watermark - posição) das partições atribuídas e
+        ajusta o tamanho do lote (por partição) e o intervalo de flush de acordo.
+        """
+        lag = 0
+        assignment = self.consumer.assignment()
+        for tp in assignment:
+            highwater = self.consumer.highwater(tp)
+            if highwater is not None:
+                lag += max(0, highwater - self.consumer.position(tp))
+        self._set_lag(lag, len(assignment))
 
-            self.consumer.commit()
-            self.logger.info(f"Offsets comitados no Kafka com sucesso.")
+    def _set_lag(self, lag, partitions):
+        self.lag = lag
+        partition_lag = lag // max(1, partitions)
+        self.batch_size = min(self.max_batch_size, max(self.min_batch_size, partition_lag))
+        self.flush_interval = self.min_flush_interval if partition_lag <= self.min_batch_size else self.max_flush_interval
 
-            self.batches.clear()
+    def _stats_mapping(self):
+        """Estatísticas a publicar em consumer:stats, ou None se ainda não é hora."""
+        if time.time() - self.last_stats_time < self.stats_interval:
+            return None
+        self.last_stats_time = time.time()
+        return {
+            "lag": self.lag,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "in_flight": len(self.in_flight),
+            "updated_at": int(time.time())
+        }
 
-        except redis.exceptions.ConnectionError as e:
-            self.logger.error(f"Conexão com Redis perdida: {e}. Tentando reconectar...")
-            self.redis_client = self._connect_redis()
+    def _publish_stats(self):
+        """Expõe o lag e o tamanho de lote atuais no Redis (consumer:stats)."""
+        mapping = self._stats_mapping()
+        if mapping is None:
+            return
+        try:
+            self.redis_client.hset("consumer:stats", mapping=mapping)
         except Exception as e:
-            self.logger.error(f"Erro ao processar lote: {repr(e)}. As mensagens serão reprocessadas.")
+            self.logger.error(f"Erro ao publicar estatísticas: {repr(e)}")
 
+    def _add_records(self, records):
+        """Converte as mensagens recebidas em itens nos lotes das respectivas partições."""
+        for tp, messages in records.items():
+            for message in messages:
+                # O offset de mensagens inválidas é comitado junto com o próximo lote
+                self.next_offsets[message.partition] = message.offset + 1
+                try:
+                    item = self._to_item(message)
+                except (ValueError, UnicodeDecodeError, EOFError, KeyError, AttributeError):
+                    self.logger.warning(f"Mensagem inválida no offset {message.offset}. Pulando.")
+                    continue
+
+                if message.partition not in self.batches:
+                    self.batches[message.partition] = []
+                self.batches[message.partition].append(item)
 
     def run(self):
         self.redis_client = self._connect_redis()
         self.consumer = self._connect_kafka()
+        if self.alerts:
+            # Limites dos silos carregados antes da primeira leitura avaliada
+            self.alerts.ready.wait()
         
         while True:
             try:
-                for message in self.consumer:
-                    try:
-                        deserialized_value = json.loads(message.value.decode('utf-8'))
-                    except (json.JSONDecodeError, UnicodeDecodeError):
-                        self.logger.warning(f"Mensagem inválida no offset {message.offset}. Pulando.")
-                        self.consumer.commit({TopicPartition(self.kafka_topic, message.partition): message.offset + 1})
-                        continue
-
-                    if message.partition not in self.batches:
-                        self.batches[message.partition] = []
-                    self.batches[message.partition].append({
-                        "value": deserialized_value,
-                        "offset": message.offset
-                    })
-
-                total_pending = sum(len(b) for b in self.batches.values())
-                time_since_flush = time.time() - self.last_flush_time
-
-                if total_pending >= self.batch_size or (total_pending > 0 and time_since_flush >= self.flush_interval):
-                    self._process_batch()
-                    self.last_flush_time = time.time()
+                records = self.consumer.poll(
+                    timeout_ms=int(self.flush_interval * 1000),
+                    max_records=self.max_batch_size
+                )
+                self._add_records(records)
+                self._update_lag()
+                self._collect_completed()
+                for partition in list(self.batches):
+                    self._dispatch(partition)
+                self._apply_backpressure()
+                self._trim_history()
+                self._publish_stats()
             
             except Exception as e:
                 self.logger.error(f"Erro inesperado no laço principal: {e}. O consumidor continuará.")
@@ -148,5 +733,9 @@ class KafkaRedisConsumer:
 if __name__ == "__main__":
     logging.info("Iniciando o conector Kafka-Redis...")
     time.sleep(15)
-    connector = KafkaRedisConsumer()
+    if os.getenv('CONSUMER_ENGINE', 'sync') == 'async':
+        from async_consumer import AsyncKafkaRedisConsumer
+        connector = AsyncKafkaRedisConsumer()
+    else:
+        connector = KafkaRedisConsumer()
     connector.run()
\ No newline at end of file
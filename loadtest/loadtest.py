@@ -0,0 +1,276 @@
+"""
+Teste de carga ponta a ponta: MQTT -> bridge -> Kafka -> consumidor -> Redis.
+
+Simula N dispositivos publicando em devices/<id>/data e devices/<id>/hello e
+mede, em cada etapa, a vazão e os percentis de latência desde o envio:
+  - bridge:   mensagem disponível no tópico Kafka (iot-data)
+  - consumer: mensagem publicada pelo KafkaRedisConsumer em device-updates:<id>
+  - redis:    mensagem presente no histórico device:history:<id> (amostrada)
+
+O resultado é gravado em JSON para acompanhar regressões entre versões.
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+import paho.mqtt.client as mqtt
+import redis
+from kafka import KafkaConsumer
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='[%(asctime)s] %(levelname)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+
+class HopRecorder:
+    """Acumula latências e contagem de uma etapa do pipeline."""
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.count = 0
+        self.first_at = None
+        self.last_at = None
+        self.lock = threading.Lock()
+
+    def record(self, sent_at, arrived_at):
+        with self.lock:
+            self.count += 1
+            self.first_at = self.first_at or arrived_at
+            self.last_at = arrived_at
+            if sent_at is not None:
+                self.latencies.append(arrived_at - sent_at)
+
+    def summary(self, expected):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            count = self.count
+            elapsed = (self.last_at - self.first_at) if count > 1 else 0.0
+
+        def percentile(p):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000, 2)
+
+        return {
+            "received": count,
+            "expected": expected,
+            "loss_ratio": round(1 - count / expected, 4) if expected else None,
+            "throughput_msgs_s": round(count / elapsed, 2) if elapsed > 0 else None,
+            "latency_ms": {
+                "p50": percentile(50),
+                "p95": percentile(95),
+                "p99": percentile(99),
+                "max": round(latencies[-1] * 1000, 2) if latencies else None,
+            },
+        }
+
+
+def make_payload(run_id, seq):
+    return {
+        "temperature": round(random.gauss(24.0, 2.0), 2),
+        "humidity": round(random.gauss(65.0, 8.0), 2),
+        "mq_rs": round(random.uniform(800, 2000), 1),
+        # Campos de controle do teste (preservados pela bridge no payload)
+        "lt_run": run_id,
+        "lt_seq": seq,
+        "lt_sent_at": time.time(),
+    }
+
+
+def extract_sent_at(message, run_id):
+    """Retorna o instante de envio se a mensagem pertence a esta execução."""
+    payload = message.get("payload", {})
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    if payload.get("lt_run") != run_id:
+        return None
+    return payload.get("lt_sent_at")
+
+
+def run_publishers(args, run_id, stop_event, sent_counter):
+    """Distribui os dispositivos entre 'clients' conexões MQTT e publica no ritmo configurado."""
+    device_ids = [f"{args.device_prefix}{i:06d}" for i in range(args.devices)]
+    groups = [device_ids[i::args.clients] for i in range(args.clients)]
+    threads = []
+
+    def publisher(devices):
+        client = mqtt.Client()
+        client.connect(args.mqtt_host, args.mqtt_port, 60)
+        client.loop_start()
+        interval = 1.0 / args.rate
+        next_hello = 0.0
+        next_tick = time.time()
+        seq = 0
+        while not stop_event.is_set():
+            now = time.time()
+            if now >= next_hello:
+                for device_id in devices:
+                    client.publish(f"devices/{device_id}/hello", "online")
+                next_hello = now + args.hello_interval
+            for device_id in devices:
+                seq += 1
+                client.publish(f"devices/{device_id}/data", json.dumps(make_payload(run_id, seq)), qos=args.qos)
+            with sent_counter["lock"]:
+                sent_counter["value"] += len(devices)
+            next_tick += interval
+            time.sleep(max(0.0, next_tick - time.time()))
+        client.loop_stop()
+        client.disconnect()
+
+    for devices in groups:
+        if devices:
+            thread = threading.Thread(target=publisher, args=(devices,), daemon=True)
+            thread.start()
+            threads.append(thread)
+    return threads
+
+
+def tap_kafka(args, run_id, recorder, stop_event):
+    consumer = KafkaConsumer(
+        args.kafka_topic,
+        bootstrap_servers=[args.kafka_broker],
+        group_id=f"loadtest-{run_id}",
+        auto_offset_reset="latest",
+        consumer_timeout_ms=1000,
+    )
+    while not stop_event.is_set():
+        for message in consumer:
+            arrived_at = time.time()
+            try:
+                sent_at = extract_sent_at(json.loads(message.value), run_id)
+            except (ValueError, UnicodeDecodeError):
+                # Formato binário (Avro): conta a mensagem sem latência
+                recorder.record(None, arrived_at)
+                continue
+            if sent_at is not None:
+                recorder.record(sent_at, arrived_at)
+            if stop_event.is_set():
+                break
+    consumer.close()
+
+
+def tap_redis_pubsub(client, run_id, recorder, stop_event):
+    pubsub = client.pubsub(ignore_subscribe_messages=True)
+    pubsub.psubscribe("device-updates:*")
+    while not stop_event.is_set():
+        message = pubsub.get_message(timeout=1.0)
+        if not message:
+            continue
+        arrived_at = time.time()
+        try:
+            sent_at = extract_sent_at(json.loads(message["data"]), run_id)
+        except ValueError:
+            continue
+        if sent_at is not None:
+            recorder.record(sent_at, arrived_at)
+    pubsub.close()
+
+
+def probe_redis_history(client, args, run_id, recorder, stop_event):
+    """Amostra o histórico de alguns dispositivos para medir quando o dado fica consultável."""
+    seen = set()
+    sample = [f"{args.device_prefix}{i:06d}" for i in range(min(args.devices, args.history_sample))]
+    while not stop_event.is_set():
+        since = time.time() - 10
+        for device_id in sample:
+            for member in client.zrangebyscore(f"device:history:{device_id}", int(since), "+inf"):
+                if member in seen:
+                    continue
+                seen.add(member)
+                try:
+                    sent_at = extract_sent_at(json.loads(member), run_id)
+                except ValueError:
+                    continue
+                if sent_at is not None:
+                    recorder.record(sent_at, time.time())
+        time.sleep(args.history_poll)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga da stack IoT (bridge, Kafka, consumidor, Redis).")
+    parser.add_argument("--devices", type=int, default=1000, help="Quantidade de dispositivos simulados")
+    parser.add_argument("--rate", type=float, default=1.0, help="Mensagens de dados por segundo por dispositivo")
+    parser.add_argument("--hello-interval", type=float, default=30.0, help="Segundos entre mensagens 'hello'")
+    parser.add_argument("--duration", type=float, default=60.0, help="Duração da publicação em segundos")
+    parser.add_argument("--drain", type=float, default=15.0, help="Segundos de espera após a publicação")
+    parser.add_argument("--clients", type=int, default=8, help="Conexões MQTT usadas pelos publicadores")
+    parser.add_argument("--qos", type=int, default=0, choices=(0, 1))
+    parser.add_argument("--device-prefix", default="LT")
+    parser.add_argument("--mqtt-host", default="localhost")
+    parser.add_argument("--mqtt-port", type=int, default=1883)
+    parser.add_argument("--kafka-broker", default="localhost:9092")
+    parser.add_argument("--kafka-topic", default="iot-data")
+    parser.add_argument("--redis-host", default="localhost")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--redis-password", default="1234")
+    parser.add_argument("--history-sample", type=int, default=20, help="Dispositivos amostrados no histórico")
+    parser.add_argument("--history-poll", type=float, default=0.2, help="Intervalo de leitura do histórico (s)")
+    parser.add_argument("--output", default="loadtest-result.json")
+    args = parser.parse_args()
+
+    run_id = uuid.uuid4().hex[:12]
+    redis_client = redis.Redis(host=args.redis_host, port=args.redis_port, password=args.redis_password, decode_responses=True)
+    hops = {
+        "bridge": HopRecorder("bridge"),
+        "consumer": HopRecorder("consumer"),
+        "redis": HopRecorder("redis"),
+    }
+    stop_taps = threading.Event()
+    stop_publishers = threading.Event()
+    sent_counter = {"value": 0, "lock": threading.Lock()}
+
+    taps = [
+        threading.Thread(target=tap_kafka, args=(args, run_id, hops["bridge"], stop_taps), daemon=True),
+        threading.Thread(target=tap_redis_pubsub, args=(redis_client, run_id, hops["consumer"], stop_taps), daemon=True),
+        threading.Thread(target=probe_redis_history, args=(redis_client, args, run_id, hops["redis"], stop_taps), daemon=True),
+    ]
+    for tap in taps:
+        tap.start()
+    # Tempo para o consumidor de teste receber as partições
+    time.sleep(5)
+
+    logging.info(f"Execução {run_id}: {args.devices} dispositivos a {args.rate} msg/s por {args.duration}s")
+    started_at = time.time()
+    publishers = run_publishers(args, run_id, stop_publishers, sent_counter)
+    time.sleep(args.duration)
+    stop_publishers.set()
+    for publisher in publishers:
+        publisher.join()
+    publish_elapsed = time.time() - started_at
+    sent = sent_counter["value"]
+
+    logging.info(f"{sent} mensagens publicadas. Aguardando {args.drain}s para o pipeline esvaziar...")
+    time.sleep(args.drain)
+    stop_taps.set()
+    for tap in taps:
+        tap.join(timeout=5)
+
+    # O histórico é amostrado: o esperado é proporcional aos dispositivos observados
+    history_expected = int(sent * min(args.devices, args.history_sample) / args.devices) if args.devices else 0
+    result = {
+        "run_id": run_id,
+        "started_at": started_at,
+        "config": vars(args),
+        "published": {
+            "messages": sent,
+            "throughput_msgs_s": round(sent / publish_elapsed, 2) if publish_elapsed > 0 else None,
+        },
+        "hops": {
+            "bridge": hops["bridge"].summary(sent),
+            "consumer": hops["consumer"].summary(sent),
+            "redis": hops["redis"].summary(history_expected),
+        },
+    }
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+    logging.info(f"Resultado gravado em {args.output}")
+    print(json.dumps(result["hops"], indent=2))
+
+
+if __name__ == "__main__":
+    main()
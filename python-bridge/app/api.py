@@ -1,12 +1,37 @@
-from fastapi import FastAPI, HTTPException
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException, Query, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from pydantic import BaseModel
 from app.services.mqtt_service import MqttService
+from app.services.pipeline_service import PipelineService
+from app.services.kafka_service import KafkaService
+from app.services.command_service import CommandService
+from app.metrics import MULTIPROCESS, QUEUE_DEPTH, ONLINE_DEVICES, metrics_registry
 
 class CommandPayload(BaseModel):
     command: str
 
-def create_api(mqtt_service: MqttService) -> FastAPI:
-    """Cria e configura a aplicação FastAPI, injetando o serviço MQTT."""
+class BulkCommandPayload(BaseModel):
+    command: str
+    device_ids: Optional[List[str]] = None
+    silo_id: Optional[int] = None
+    qos: Optional[int] = None
+
+def create_api(mqtt_service: MqttService, pipeline_service: PipelineService = None, kafka_service: KafkaService = None,
+               command_service: CommandService = None, worker_pool=None) -> FastAPI:
+    """
+    Cria e configura a aplicação FastAPI, injetando os serviços MQTT, pipeline, Kafka e de comandos.
+    No modo multiprocesso recebe o WorkerPool, já que pipeline e produtor ficam nos workers.
+    """
+    command_service = command_service or CommandService(mqtt_service)
+
+    # Gauges calculados no momento da coleta (no modo multiprocesso, atualizados no GET /metrics)
+    if not MULTIPROCESS:
+        ONLINE_DEVICES.set_function(mqtt_service.registry.count)
+    if pipeline_service:
+        QUEUE_DEPTH.labels(queue="pipeline").set_function(lambda: pipeline_service.get_stats()["depth"])
+    if kafka_service:
+        QUEUE_DEPTH.labels(queue="kafka_producer").set_function(lambda: len(kafka_service.producer))
     
     app = FastAPI(
         title="IoT Bridge API",
@@ -14,15 +39,22 @@ def create_api(mqtt_service: MqttService) -> FastAPI:
     )
 
     @app.get("/devices", tags=["Devices"])
-    def list_online_devices():
+    def list_online_devices(
+        offset: int = Query(0, ge=0),
+        limit: int = Query(100, ge=1, le=1000),
+        prefix: Optional[str] = Query(None, description="Filtra pelo prefixo do device_id"),
+        seen_within: Optional[float] = Query(None, gt=0, description="Somente dispositivos vistos nos últimos N segundos")
+    ):
         """
-        Retorna uma lista de todos os dispositivos que estão atualmente online
+        Retorna, de forma paginada, os dispositivos que estão atualmente online
         e o timestamp da última vez que foram vistos.
         """
-        online_devices = mqtt_service.get_online_devices()
+        total, devices = mqtt_service.registry.query(offset=offset, limit=limit, prefix=prefix, seen_within=seen_within)
         return {
-            "online_count": len(online_devices),
-            "devices": online_devices
+            "online_count": total,
+            "offset": offset,
+            "limit": limit,
+            "devices": devices
         }
 
     @app.post("/devices/{device_id}/command", tags=["Commands"])
@@ -30,8 +62,7 @@ def create_api(mqtt_service: MqttService) -> FastAPI:
         """
         Envia um comando (ex: 'start' ou 'stop') para um dispositivo específico.
         """
-        online_devices = mqtt_service.get_online_devices()
-        if device_id not in online_devices:
+        if not mqtt_service.is_online(device_id):
             raise HTTPException(
                 status_code=404, 
                 detail=f"Dispositivo '{device_id}' não encontrado ou está offline."
@@ -50,5 +81,70 @@ def create_api(mqtt_service: MqttService) -> FastAPI:
             "device_id": device_id,
             "command_sent": payload.command
         }
+
+    @app.post("/commands/bulk", status_code=202, tags=["Commands"])
+    def send_bulk_command(payload: BulkCommandPayload):
+        """
+        Envia um comando para uma lista de dispositivos e/ou para todos os
+        dispositivos de um silo. As publicações ocorrem em paralelo; o resultado
+        por dispositivo é consultado em GET /commands/{job_id}.
+        """
+        if payload.qos is not None and payload.qos not in (0, 1, 2):
+            raise HTTPException(status_code=422, detail="QoS deve ser 0, 1 ou 2.")
+
+        device_ids = list(payload.device_ids or [])
+        if payload.silo_id is not None:
+            try:
+                device_ids += command_service.resolve_silo_devices(payload.silo_id)
+            except Exception as e:
+                raise HTTPException(
+                    status_code=502,
+                    detail=f"Falha ao buscar dispositivos do silo '{payload.silo_id}': {e}"
+                )
+        if not device_ids:
+            raise HTTPException(status_code=400, detail="Nenhum dispositivo informado para o comando.")
+
+        job = command_service.create_job(device_ids, payload.command, payload.qos)
+        return {
+            "job_id": job["job_id"],
+            "command": job["command"],
+            "total": len(job["devices"])
+        }
+
+    @app.get("/commands/{job_id}", tags=["Commands"])
+    def get_command_job(job_id: str):
+        """
+        Retorna o estado de um job de comando em massa: resumo e status por
+        dispositivo (pending, published, acked, ack_timeout, offline, failed).
+        """
+        job = command_service.get_job(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job '{job_id}' não encontrado.")
+        return job
+
+    @app.get("/metrics", tags=["Pipeline"])
+    def metrics():
+        """Métricas no formato do Prometheus (somadas entre os workers no modo multiprocesso)."""
+        if MULTIPROCESS:
+            ONLINE_DEVICES.set(mqtt_service.registry.count())
+        return Response(content=generate_latest(metrics_registry()), media_type=CONTENT_TYPE_LATEST)
+
+    @app.get("/pipeline/stats", tags=["Pipeline"])
+    def pipeline_stats():
+        """
+        Retorna a profundidade dos buffers do pipeline, contadores de descarte
+        e as estatísticas de entrega do produtor Kafka. No modo multiprocesso
+        retorna o estado dos processos de ingestão.
+        """
+        if worker_pool:
+            return {
+                "pipeline": None,
+                "kafka": None,
+                "workers": worker_pool.get_stats()
+            }
+        return {
+            "pipeline": pipeline_service.get_stats() if pipeline_service else None,
+            "kafka": kafka_service.get_stats() if kafka_service else None
+        }
         
     return app
\ No newline at end of file
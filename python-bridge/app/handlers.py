@@ -0,0 +1,35 @@
+import json
+import logging
+import time
+from app import settings
+
+def build_data_handler(kafka_service, aggregation_service=None):
+    """Cria o callback de dados ligado aos serviços Kafka/agregação do processo."""
+
+    def data_handler_callback(device_id: str, payload: str, recv_ts: float = None):
+        """
+        Callback que formata a mensagem e a entrega ao KafkaService.
+        Executado pelos workers do pipeline, fora da thread de rede do MQTT.
+        """
+        try:
+            data_dict = json.loads(payload)
+            timestamp = recv_ts or time.time()
+
+            # Modo de pré-agregação: acumula a leitura na janela do dispositivo
+            if aggregation_service and isinstance(data_dict, dict):
+                aggregation_service.add(device_id, data_dict, timestamp)
+                if not settings.RAW_PASSTHROUGH:
+                    return
+
+            message = {
+                "device_id": device_id,
+                "payload": data_dict,
+                "timestamp": int(timestamp)
+            }
+            # Passa o device_id como 'key' e a mensagem como 'value' para o kafka criar reparticoes por id de placa
+            kafka_service.send_data(key=device_id, value=message)
+
+        except Exception as e:
+            logging.error(f"Erro ao processar dados de '{device_id}': {e}")
+
+    return data_handler_callback
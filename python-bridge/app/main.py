@@ -5,57 +5,80 @@ import json
 import time
 import os
 from app import settings
+from app.handlers import build_data_handler
+from app.worker import WorkerPool
 from app.services.mqtt_service import MqttService
 from app.services.kafka_service import KafkaService
+from app.services.pipeline_service import PipelineService
+from app.services.command_service import CommandService
+from app.services.aggregation_service import AggregationService
 from app.api import create_api
 
-# --- Inicialização dos Serviços ---
-mqtt_service = MqttService()
-kafka_service = KafkaService()
-app = create_api(mqtt_service=mqtt_service) # Cria a API injetando o serviço MQTT
+# --- Ponto de Entrada da Aplicação ---
+# Os serviços são criados dentro de main(): no modo multiprocesso os workers
+# ('spawn') reimportam este módulo como __mp_main__ e não devem construí-los
+def main():
+    # --- Inicialização dos Serviços ---
+    # No modo multiprocesso este processo é só o plano de controle: não assina tópicos,
+    # recebe a presença dos dispositivos dos workers e publica os comandos
+    sharded = settings.BRIDGE_PROCESSES > 1
+    mqtt_service = MqttService(topics=[] if sharded else None)
+    worker_pool = WorkerPool(settings.BRIDGE_PROCESSES, mqtt_service.registry) if sharded else None
+    # Produtor Kafka e pipeline só existem no processo que faz a ingestão: no modo
+    # multiprocesso ficam nos workers, e as estatísticas vêm do WorkerPool
+    kafka_service = None if sharded else KafkaService()
+    pipeline_service = None if sharded else PipelineService(handler=mqtt_service.dispatch_data)
+    command_service = CommandService(mqtt_service)
+    if settings.AGGREGATION_ENABLED and sharded:
+        logging.warning("Pré-agregação desativada no modo multiprocesso (BRIDGE_PROCESSES > 1).")
+    aggregation_service = AggregationService(kafka_service) if settings.AGGREGATION_ENABLED and not sharded else None
+    app = create_api(mqtt_service=mqtt_service, pipeline_service=pipeline_service, kafka_service=kafka_service,
+                     command_service=command_service, worker_pool=worker_pool) # Cria a API injetando os serviços
 
-# --- Lógica de Negócio (Callbacks) ---
-def data_handler_callback(device_id: str, payload: str):
-    """
-    Callback que formata a mensagem e a entrega ao KafkaService.
-    """
     try:
-        data_dict = json.loads(payload)
-        message = {
-            "device_id": device_id,
-            "payload": data_dict,
-            "timestamp": int(time.time())
-        }
-        # Passa o device_id como 'key' e a mensagem como 'value' para o kafka criar reparticoes por id de placa
-        kafka_service.send_data(key=device_id, value=message)
-
-    except Exception as e:
-        logging.error(f"Erro ao processar dados de '{device_id}': {e}")
+        if worker_pool:
+            # 1. Modo multiprocesso: a ingestão fica a cargo dos processos workers
+            worker_pool.start()
+        else:
+            # 1. Registra o callback de dados no serviço MQTT
+            mqtt_service.register_data_callback(build_data_handler(kafka_service, aggregation_service))
 
-# --- Ponto de Entrada da Aplicação ---
-def main():
-    # 1. Registra o callback de dados no serviço MQTT
-    mqtt_service.register_data_callback(data_handler_callback)
-    
-    # 2. Conecta ao MQTT
-    mqtt_service.connect()
-    
-    # 3. Inicia o loop do MQTT em segundo plano (NÃO bloqueia a execução)
-    mqtt_service.start_background_loop()
-    
-    # 5. Inicia o servidor da API (Uvicorn)
-    logging.info(f"Iniciando API na porta {settings.API_PORT}")
-    uvicorn.run(
-        app,
-        host=settings.API_HOST,        # no container, use 0.0.0.0
-        port=settings.API_PORT,        # 8000 no contêiner; Nginx fala com 127.0.0.1:8090 → 8000
-        root_path=settings.ROOT_PATH,           # <- chave para servir em /bridge/
-        proxy_headers=True,            # honra X-Forwarded-Proto/Host do Nginx
-        forwarded_allow_ips="*"        # ou limite ao IP do Nginx se preferir
-    )
+            # 1.1 Inicia os workers e direciona as mensagens de dados para o pipeline
+            pipeline_service.start()
+            mqtt_service.register_pipeline(pipeline_service)
+        
+        # 2. Conecta ao MQTT
+        mqtt_service.connect()
+        
+        # 3. Inicia o loop do MQTT em segundo plano (NÃO bloqueia a execução)
+        mqtt_service.start_background_loop()
+        
+        # 5. Inicia o servidor da API (Uvicorn)
+        logging.info(f"Iniciando API na porta {settings.API_PORT}")
+        uvicorn.run(
+            app,
+            host=settings.API_HOST,        # no container, use 0.0.0.0
+            port=settings.API_PORT,        # 8000 no contêiner; Nginx fala com 127.0.0.1:8090 → 8000
+            root_path=settings.ROOT_PATH,           # <- chave para servir em /bridge/
+            proxy_headers=True,            # honra X-Forwarded-Proto/Host do Nginx
+            forwarded_allow_ips="*"        # ou limite ao IP do Nginx se preferir
+        )
+    finally:
+        command_service.shutdown()
+        if worker_pool:
+            worker_pool.stop()
+        # Processa o que restou nos buffers antes de esvaziar o produtor
+        if pipeline_service:
+            pipeline_service.stop()
+        # Publica as janelas parciais antes de esvaziar o produtor
+        if aggregation_service:
+            aggregation_service.close()
+        # Garante que as mensagens ainda na fila do produtor sejam entregues
+        if kafka_service:
+            kafka_service.close()
 
 if __name__ == "__main__":
     try:
         main()
     except KeyboardInterrupt:
-        logging.info("Serviço encerrado pelo usuário.")
\ No newline at end of file
+        logging.info("Serviço encerrado pelo usuário.")
@@ -0,0 +1,89 @@
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from app import settings
+
+# Modo multiprocesso (BRIDGE_PROCESSES > 1): as métricas são gravadas pelos workers em
+# PROMETHEUS_MULTIPROC_DIR e somadas no GET /metrics do processo da API. A variável
+# precisa existir antes do primeiro import do prometheus_client, e os workers ('spawn')
+# a herdam do processo pai. Um diretório informado externamente deve estar vazio na partida.
+if settings.BRIDGE_PROCESSES > 1 and not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="bridge-metrics-")
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+
+# Métricas do caminho MQTT -> pipeline -> Kafka, expostas em GET /metrics
+MESSAGES_RECEIVED = Counter(
+    "bridge_messages_received_total", "Mensagens MQTT recebidas", ["topic_type"]
+)
+MESSAGES_PRODUCED = Counter(
+    "bridge_messages_produced_total", "Mensagens confirmadas pelo Kafka", ["topic"]
+)
+MESSAGES_FAILED = Counter(
+    "bridge_messages_failed_total", "Mensagens rejeitadas pelo Kafka", ["topic"]
+)
+MESSAGES_DROPPED = Counter(
+    "bridge_messages_dropped_total", "Mensagens descartadas por falta de espaço", ["stage"]
+)
+PRODUCE_LATENCY = Histogram(
+    "bridge_produce_latency_seconds", "Tempo entre o produce() e a confirmação de entrega",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+# No modo multiprocesso: profundidade somada entre os workers vivos; dispositivos
+# online vêm só do processo da API (os workers ficam em 0)
+QUEUE_DEPTH = Gauge(
+    "bridge_queue_depth", "Mensagens aguardando em cada fila", ["queue"], multiprocess_mode="livesum"
+)
+ONLINE_DEVICES = Gauge(
+    "bridge_online_devices", "Dispositivos online no registro", multiprocess_mode="livemax"
+)
+
+def metrics_registry():
+    """Registro usado no GET /metrics: no modo multiprocesso, agrega os arquivos de todos os processos."""
+    if not MULTIPROCESS:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+def mark_process_dead(pid: int):
+    """Remove os gauges 'live*' de um worker encerrado (sem efeito fora do modo multiprocesso)."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
+
+def log_sampled(fmt: str, *args):
+    """
+    Log por mensagem em DEBUG, amostrado para não pesar no caminho quente.
+    Recebe o formato e os argumentos separados (estilo %s do logging): a
+    mensagem só é formatada quando passa pela amostragem e pelo nível.
+    """
+    if random.random() < settings.LOG_SAMPLE_RATE and logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(fmt, *args)
+
+class DropLogger:
+    """
+    Resume os descartes (ou falhas) num único log por intervalo, em vez de um
+    por mensagem: sob sobrecarga o log por mensagem só agravaria a situação.
+    O total exato fica nos contadores do Prometheus.
+    """
+    def __init__(self, message: str, interval: float = None, level: int = logging.WARNING):
+        # Formato com um %s para a quantidade, seguido dos argumentos do último record()
+        self.message = message
+        self.interval = settings.DROP_LOG_INTERVAL_SECONDS if interval is None else interval
+        self.level = level
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_log = 0.0
+
+    def record(self, *args):
+        now = time.monotonic()
+        with self._lock:
+            self._pending += 1
+            if now - self._last_log < self.interval:
+                return
+            count, self._pending, self._last_log = self._pending, 0, now
+        logging.log(self.level, self.message, count, *args)
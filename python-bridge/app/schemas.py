@@ -0,0 +1,49 @@
+import json
+
+# Schema Avro das mensagens do tópico iot-data (registrado no schema-registry).
+# Os campos de sensor conhecidos têm tipo fixo; demais chaves do payload vão
+# para 'extra' codificadas como JSON, preservando qualquer dado enviado pela placa.
+SENSOR_READING_SCHEMA = json.dumps({
+    "type": "record",
+    "name": "SensorReading",
+    "namespace": "iot",
+    "fields": [
+        {"name": "device_id", "type": "string"},
+        {"name": "timestamp", "type": "long"},
+        {"name": "temperature", "type": ["null", "double"], "default": None},
+        {"name": "humidity", "type": ["null", "double"], "default": None},
+        {"name": "mq_rs", "type": ["null", "double"], "default": None},
+        {"name": "extra", "type": {"type": "map", "values": "string"}, "default": {}}
+    ]
+})
+
+SENSOR_FIELDS = ("temperature", "humidity", "mq_rs")
+
+
+def _as_double(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def message_to_avro(message: dict, ctx=None) -> dict:
+    """Converte a mensagem {device_id, payload, timestamp} para o registro Avro."""
+    payload = message.get("payload") or {}
+    if not isinstance(payload, dict):
+        payload = {"value": payload}
+
+    record = {
+        "device_id": message["device_id"],
+        "timestamp": int(message["timestamp"]),
+        "extra": {},
+    }
+    for field in SENSOR_FIELDS:
+        record[field] = None
+    for key, value in payload.items():
+        number = _as_double(value) if key in SENSOR_FIELDS else None
+        if number is not None:
+            record[key] = number
+        else:
+            record["extra"][key] = json.dumps(value)
+    return record
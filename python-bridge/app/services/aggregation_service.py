@@ -0,0 +1,143 @@
+import logging
+import math
+import threading
+import time
+from app import settings
+
+def mq135_to_co2_ppm(rs, r0=1040):
+    """Mesma curva do MQ135 usada pelo serviço Spark, para que os agregados sejam equivalentes."""
+    if not rs or rs <= 0:
+        return None
+    try:
+        return round(math.pow(10, ((math.log10(rs / r0) - 1.92) / -0.42)), 2)
+    except (ValueError, OverflowError):
+        return None
+
+class _Accumulator:
+    """Acumulador de passada única (Welford) para média, variância, mínimo e máximo."""
+    __slots__ = ("count", "mean", "m2", "min", "max", "over_limit")
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.over_limit = 0
+
+    def add(self, value: float, limit: float = None):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None or value < self.min else self.min
+        self.max = value if self.max is None or value > self.max else self.max
+        if limit is not None and value > limit:
+            self.over_limit += 1
+
+    def to_dict(self, window_count: int) -> dict:
+        return {
+            "count": self.count,
+            "avg": self.mean,
+            "min": self.min,
+            "max": self.max,
+            # Desvio padrão amostral, como o stddev() do Spark
+            "std": math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else None,
+            "percent_over_limit": self.over_limit / window_count * 100 if window_count else 0.0,
+        }
+
+class _Window:
+    __slots__ = ("start", "count", "metrics")
+
+    def __init__(self, start: int):
+        self.start = start
+        self.count = 0
+        self.metrics = {}
+
+class AggregationService:
+    """
+    Mantém, por dispositivo, uma janela fixa (tumbling) com acumuladores das
+    métricas e publica um único registro agregado por janela no tópico de
+    agregados. Janelas são fechadas quando chega uma leitura da janela seguinte
+    ou, por uma thread de fundo, quando o prazo de tolerância expira.
+    """
+    def __init__(self, kafka_service):
+        self.kafka_service = kafka_service
+        self.window_seconds = settings.AGGREGATION_WINDOW_SECONDS
+        self.limits = {
+            "temperature": settings.AGGREGATION_MAX_TEMPERATURE,
+            "humidity": settings.AGGREGATION_MAX_HUMIDITY,
+        }
+        self._windows = {}  # device_id -> _Window aberta
+        self._lock = threading.Lock()
+        self._running = True
+        self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flusher.start()
+
+    def _values(self, payload: dict) -> dict:
+        values = {}
+        for field in ("temperature", "humidity"):
+            try:
+                values[field] = float(payload.get(field))
+            except (TypeError, ValueError):
+                pass
+        co2_ppm = mq135_to_co2_ppm(payload.get("mq_rs") or 0)
+        if co2_ppm is not None:
+            values["co2_ppm"] = co2_ppm
+        return values
+
+    def add(self, device_id: str, payload: dict, timestamp: float):
+        """Acumula uma leitura na janela do dispositivo."""
+        window_start = int(timestamp) - int(timestamp) % self.window_seconds
+        closed = None
+        with self._lock:
+            window = self._windows.get(device_id)
+            if window is None or window_start > window.start:
+                closed = window
+                window = self._windows[device_id] = _Window(window_start)
+            # Leituras atrasadas de uma janela já fechada entram na janela atual
+            window.count += 1
+            for field, value in self._values(payload).items():
+                accumulator = window.metrics.get(field)
+                if accumulator is None:
+                    accumulator = window.metrics[field] = _Accumulator()
+                accumulator.add(value, self.limits.get(field))
+        if closed is not None:
+            self._emit(device_id, closed)
+
+    def _emit(self, device_id: str, window: _Window):
+        record = {
+            "device_id": device_id,
+            "window_start": window.start,
+            "window_end": window.start + self.window_seconds,
+            "count": window.count,
+            "metrics": {field: acc.to_dict(window.count) for field, acc in window.metrics.items()},
+        }
+        self.kafka_service.send_data(key=device_id, value=record, topic=settings.KAFKA_TOPIC_AGGREGATES)
+
+    def _flush_expired(self, now: float):
+        cutoff = now - self.window_seconds - settings.AGGREGATION_GRACE_SECONDS
+        with self._lock:
+            expired = [(device_id, window) for device_id, window in self._windows.items() if window.start <= cutoff]
+            for device_id, _ in expired:
+                del self._windows[device_id]
+        for device_id, window in expired:
+            self._emit(device_id, window)
+
+    def _flush_loop(self):
+        while self._running:
+            try:
+                self._flush_expired(time.time())
+            except Exception as e:
+                logging.error(f"Erro ao fechar janelas de agregação: {e}")
+            time.sleep(1)
+
+    def close(self):
+        """Publica todas as janelas abertas (parciais) antes do encerramento."""
+        self._running = False
+        with self._lock:
+            pending = list(self._windows.items())
+            self._windows.clear()
+        for device_id, window in pending:
+            self._emit(device_id, window)
+        logging.info(f"{len(pending)} janelas de agregação publicadas no encerramento.")
@@ -0,0 +1,107 @@
+import json
+import logging
+import threading
+import time
+import urllib.request
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from app import settings
+from app.services.mqtt_service import MqttService
+
+class CommandService:
+    """
+    Envia um mesmo comando para vários dispositivos em paralelo e acompanha,
+    por dispositivo, se a publicação foi aceita e confirmada pelo broker.
+    """
+    def __init__(self, mqtt_service: MqttService):
+        self.mqtt_service = mqtt_service
+        self._executor = ThreadPoolExecutor(max_workers=settings.COMMAND_WORKERS, thread_name_prefix="command")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve_silo_devices(self, silo_id: int) -> List[str]:
+        """Busca no NestJS os dispositivos online associados ao silo."""
+        with urllib.request.urlopen(f"{settings.SILO_DEVICES_URL}/{silo_id}/online", timeout=10) as res:
+            data = json.loads(res.read())
+        return [device["id"] for device in data.get("devices", [])]
+
+    def create_job(self, device_ids: List[str], command: str, qos: int = None) -> dict:
+        """Registra o job e agenda as publicações; retorna imediatamente."""
+        qos = settings.COMMAND_QOS if qos is None else qos
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "command": command,
+            "qos": qos,
+            "created_at": time.time(),
+            "devices": {device_id: {"status": "pending"} for device_id in dict.fromkeys(device_ids)},
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            # Mantém apenas os jobs mais recentes em memória
+            while len(self._jobs) > settings.COMMAND_JOBS_MAX:
+                self._jobs.popitem(last=False)
+
+        for device_id in job["devices"]:
+            self._executor.submit(self._publish, job, device_id)
+        logging.info(f"Job de comando '{job_id}' criado: '{command}' para {len(job['devices'])} dispositivos.")
+        return job
+
+    def _set_status(self, job: dict, device_id: str, status: str):
+        with self._lock:
+            entry = job["devices"][device_id]
+            entry["status"] = status
+            entry[f"{status}_at"] = time.time()
+
+    def _publish(self, job: dict, device_id: str):
+        if not self.mqtt_service.is_online(device_id):
+            self._set_status(job, device_id, "offline")
+            return
+        try:
+            accepted = self.mqtt_service.publish_command_tracked(
+                device_id, job["command"], job["qos"],
+                on_ack=lambda: self._set_status(job, device_id, "acked")
+            )
+        except Exception as e:
+            logging.error(f"Erro ao publicar comando para '{device_id}': {e}")
+            accepted = False
+        if not accepted:
+            self._set_status(job, device_id, "failed")
+            return
+        with self._lock:
+            # A confirmação pode ter chegado antes desta atualização
+            if job["devices"][device_id]["status"] == "pending":
+                job["devices"][device_id]["status"] = "published"
+                job["devices"][device_id]["published_at"] = time.time()
+
+    def get_job(self, job_id: str):
+        """Retorna o estado do job com o resumo por status, ou None se não existir."""
+        now = time.time()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            devices = {}
+            for device_id, entry in job["devices"].items():
+                entry = dict(entry)
+                # Publicado sem confirmação dentro do prazo
+                if entry["status"] == "published" and now - entry["published_at"] > settings.COMMAND_ACK_TIMEOUT:
+                    entry["status"] = "ack_timeout"
+                devices[device_id] = entry
+        summary = {}
+        for entry in devices.values():
+            summary[entry["status"]] = summary.get(entry["status"], 0) + 1
+        return {
+            "job_id": job["job_id"],
+            "command": job["command"],
+            "qos": job["qos"],
+            "created_at": job["created_at"],
+            "total": len(devices),
+            "summary": summary,
+            "devices": devices,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
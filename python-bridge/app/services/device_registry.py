@@ -0,0 +1,89 @@
+import heapq
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+class DeviceRegistry:
+    """
+    Registro thread-safe dos dispositivos online.
+
+    Cada 'hello' atualiza o último visto do dispositivo e insere sua expiração
+    num heap ordenado por tempo (O(log n)). Uma thread de limpeza remove do
+    registro apenas os dispositivos cujo prazo venceu, sem varrer todos.
+    Entradas antigas no heap (de hellos anteriores) são ignoradas ao sair dele.
+    """
+    def __init__(self, timeout: float, sweep_interval: float = 1.0):
+        self.timeout = timeout
+        self.sweep_interval = sweep_interval
+        self._last_seen: Dict[str, float] = {}
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+        self._running = True
+        self._sweeper = threading.Thread(target=self._sweep_loop, daemon=True)
+        self._sweeper.start()
+
+    def touch(self, device_id: str, seen_at: float = None):
+        """Registra que o dispositivo foi visto agora (ou em 'seen_at')."""
+        seen_at = seen_at or time.time()
+        with self._lock:
+            self._last_seen[device_id] = seen_at
+            heapq.heappush(self._expiry_heap, (seen_at + self.timeout, device_id))
+            # Compacta o heap se as entradas obsoletas dominarem
+            if len(self._expiry_heap) > 2 * len(self._last_seen) + 1024:
+                self._expiry_heap = [(ts + self.timeout, dev_id) for dev_id, ts in self._last_seen.items()]
+                heapq.heapify(self._expiry_heap)
+
+    def _sweep(self, now: float):
+        with self._lock:
+            heap = self._expiry_heap
+            while heap and heap[0][0] <= now:
+                expires_at, device_id = heapq.heappop(heap)
+                last_seen = self._last_seen.get(device_id)
+                # Só remove se esta for a expiração do hello mais recente
+                if last_seen is not None and last_seen + self.timeout <= expires_at:
+                    del self._last_seen[device_id]
+
+    def _sweep_loop(self):
+        while self._running:
+            try:
+                self._sweep(time.time())
+            except Exception as e:
+                logging.error(f"Erro na limpeza do registro de dispositivos: {e}")
+            time.sleep(self.sweep_interval)
+
+    def is_online(self, device_id: str) -> bool:
+        with self._lock:
+            last_seen = self._last_seen.get(device_id)
+        return last_seen is not None and (time.time() - last_seen) < self.timeout
+
+    def count(self) -> int:
+        """Quantidade de dispositivos online (O(1), atualizado pela limpeza)."""
+        return len(self._last_seen)
+
+    def snapshot(self) -> Dict[str, float]:
+        """Cópia dos dispositivos online e do timestamp em que foram vistos."""
+        now = time.time()
+        with self._lock:
+            items = list(self._last_seen.items())
+        return {dev_id: ts for dev_id, ts in items if (now - ts) < self.timeout}
+
+    def query(self, offset: int = 0, limit: int = 100, prefix: Optional[str] = None,
+              seen_within: Optional[float] = None) -> Tuple[int, Dict[str, float]]:
+        """
+        Retorna (total, página) dos dispositivos online ordenados por id,
+        filtrando por prefixo do id e/ou por 'visto nos últimos N segundos'.
+        """
+        max_age = self.timeout if seen_within is None else min(seen_within, self.timeout)
+        now = time.time()
+        with self._lock:
+            items = list(self._last_seen.items())
+        matches = sorted(
+            (dev_id, ts) for dev_id, ts in items
+            if (now - ts) < max_age and (not prefix or dev_id.startswith(prefix))
+        )
+        return len(matches), dict(matches[offset:offset + limit])
+
+    def stop(self):
+        self._running = False
@@ -1,30 +1,145 @@
-
 import logging
 import os
 import json
-from confluent_kafka import Producer 
+import threading
+import time
+from confluent_kafka import Producer
+from confluent_kafka.serialization import SerializationContext, MessageField
+from confluent_kafka.schema_registry import SchemaRegistryClient
+from confluent_kafka.schema_registry.avro import AvroSerializer
 from app import settings
+from app.schemas import SENSOR_READING_SCHEMA, message_to_avro
+from app.metrics import MESSAGES_PRODUCED, MESSAGES_FAILED, MESSAGES_DROPPED, PRODUCE_LATENCY, DropLogger, log_sampled
 
 class KafkaService:
     def __init__(self):
         producer_config = {
-            "bootstrap.servers": settings.KAFKA_BROKER
+            "bootstrap.servers": settings.KAFKA_BROKER,
+            # Agrupa mensagens em lotes em vez de enviar uma a uma
+            "linger.ms": settings.KAFKA_LINGER_MS,
+            "batch.size": settings.KAFKA_BATCH_SIZE,
+            "compression.type": settings.KAFKA_COMPRESSION,
+            # Fila interna limitada: quando cheia, produce() levanta BufferError
+            "queue.buffering.max.messages": settings.KAFKA_QUEUE_MAX_MESSAGES,
         }
 
         self.producer = Producer(producer_config)
-        
-        logging.info("Produtor JSON para Kafka conectado com sucesso!")
 
-    def send_data(self, key, value):
-        """Envia uma mensagem para o Kafka como JSON."""
+        # Serializador Avro opcional: o schema é registrado no schema-registry no primeiro envio
+        self._avro_serializer = None
+        self._avro_context = SerializationContext(settings.KAFKA_TOPIC_DATA, MessageField.VALUE)
+        if settings.KAFKA_VALUE_FORMAT == "avro":
+            registry_client = SchemaRegistryClient({"url": settings.SCHEMA_REGISTRY_URL})
+            self._avro_serializer = AvroSerializer(registry_client, SENSOR_READING_SCHEMA, to_dict=message_to_avro)
+            logging.info(f"Formato Avro habilitado (schema-registry: {settings.SCHEMA_REGISTRY_URL}).")
+
+        # Contadores de entrega atualizados pelos callbacks do produtor
+        self._stats_lock = threading.Lock()
+        self.delivered_count = 0
+        self.failed_count = 0
+        self.dropped_count = 0
+        self._drop_logger = DropLogger("Fila do produtor Kafka cheia: %s mensagens descartadas desde o último aviso.")
+        self._failure_logger = DropLogger("Falha na entrega ao Kafka: %s mensagens desde o último aviso (última: Chave='%s', %s)",
+                                          level=logging.ERROR)
+
+        # Thread que atende os callbacks de entrega mesmo sem tráfego novo
+        self._running = True
+        self._poll_thread = threading.Thread(target=self._poll_loop, daemon=True)
+        self._poll_thread.start()
+
+        logging.info("Produtor para Kafka conectado com sucesso!")
+
+    def _poll_loop(self):
+        while self._running:
+            try:
+                self.producer.poll(0.5)
+            except Exception as e:
+                # Uma exceção num callback de entrega não pode parar o atendimento dos demais
+                logging.error(f"Erro ao atender callbacks do produtor Kafka: {e}")
+
+    def _on_delivery(self, err, msg):
+        """Callback chamado pelo produtor quando o broker confirma (ou rejeita) uma mensagem."""
+        if err is not None:
+            with self._stats_lock:
+                self.failed_count += 1
+            MESSAGES_FAILED.labels(topic=msg.topic()).inc()
+            self._failure_logger.record(msg.key(), err)
+        else:
+            with self._stats_lock:
+                self.delivered_count += 1
+            MESSAGES_PRODUCED.labels(topic=msg.topic()).inc()
+            latency = msg.latency()
+            if latency is not None:
+                PRODUCE_LATENCY.observe(latency)
+
+    def _produce(self, key, value, topic, headers=None):
+        """
+        Enfileira a mensagem no produtor aplicando a política de backpressure
+        quando a fila interna está cheia. Retorna False se a mensagem foi descartada.
+        """
+        deadline = time.monotonic() + settings.KAFKA_BACKPRESSURE_TIMEOUT
+        while True:
+            try:
+                self.producer.produce(
+                    topic=topic,
+                    key=key,
+                    value=value,
+                    headers=headers,
+                    on_delivery=self._on_delivery
+                )
+                return True
+            except BufferError:
+                if settings.KAFKA_BACKPRESSURE != "block" or time.monotonic() >= deadline:
+                    with self._stats_lock:
+                        self.dropped_count += 1
+                    MESSAGES_DROPPED.labels(stage="kafka_queue").inc()
+                    self._drop_logger.record()
+                    return False
+                # Libera espaço na fila atendendo entregas pendentes
+                self.producer.poll(0.1)
+
+    def _serialize(self, value, topic):
+        """Serializa o dicionário 'value' em Avro (wire format do schema-registry) ou JSON."""
+        if self._avro_serializer and topic == settings.KAFKA_TOPIC_DATA:
+            return self._avro_serializer(value, self._avro_context)
+        return json.dumps(value).encode('utf-8')
+
+    def send_data(self, key, value, topic=None):
+        """Envia uma mensagem para o Kafka como JSON ou Avro (de forma assíncrona)."""
+        topic = topic or settings.KAFKA_TOPIC_DATA
         try:
-            # Serializa o dicionário 'value' para uma string JSON e a codifica para bytes
-            json_value = json.dumps(value).encode('utf-8')
+            serialized_value = self._serialize(value, topic)
             # Codifica a chave (que é uma string) para bytes
             encoded_key = key.encode('utf-8')
 
-            self.producer.produce(topic=settings.KAFKA_TOPIC_DATA, key=encoded_key, value=json_value)
-            self.producer.flush(10)
-            logging.info(f"Dado JSON enviado para o tópico '{settings.KAFKA_TOPIC_DATA}' com Chave='{key}': {value}")
+            # Headers permitem ao consumidor rotear a mensagem sem decodificar o valor
+            headers = [("device_id", encoded_key)]
+            if "timestamp" in value:
+                headers.append(("timestamp", str(value["timestamp"]).encode('utf-8')))
+
+            if self._produce(encoded_key, serialized_value, topic, headers):
+                log_sampled("Dado enfileirado para o tópico '%s' com Chave='%s': %s", topic, key, value)
+            # Atende callbacks de entrega já disponíveis sem bloquear
+            self.producer.poll(0)
         except Exception as e:
-            logging.error(f"Erro ao enviar mensagem JSON para o Kafka: {e}")
\ No newline at end of file
+            logging.error(f"Erro ao enviar mensagem para o Kafka: {e}")
+
+    def get_stats(self) -> dict:
+        """Retorna os contadores de entrega e o tamanho atual da fila do produtor."""
+        with self._stats_lock:
+            return {
+                "delivered": self.delivered_count,
+                "failed": self.failed_count,
+                "dropped": self.dropped_count,
+                "queued": len(self.producer),
+            }
+
+    def close(self):
+        """Esvazia a fila do produtor antes de encerrar o serviço."""
+        self._running = False
+        self._poll_thread.join(timeout=2)
+        remaining = self.producer.flush(settings.KAFKA_FLUSH_TIMEOUT)
+        if remaining > 0:
+            logging.error(f"{remaining} mensagens não foram entregues ao Kafka antes do encerramento.")
+        else:
+            logging.info("Fila do produtor Kafka esvaziada com sucesso.")
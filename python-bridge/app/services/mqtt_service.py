@@ -1,28 +1,53 @@
 import logging
+import threading
 import time
 from typing import Dict
 import paho.mqtt.client as mqtt
 from app import settings
+from app.services.device_registry import DeviceRegistry
+from app.metrics import MESSAGES_RECEIVED, log_sampled
 
 class MqttService:
-    def __init__(self):
+    def __init__(self, topics=None):
         self.client = mqtt.Client()
+        # Tópicos assinados na conexão (lista vazia: apenas publica comandos)
+        self.topics = topics if topics is not None else [(settings.MQTT_DATA_TOPIC, 0), (settings.MQTT_HELLO_TOPIC, 0)]
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
+        self.client.on_publish = self._on_publish
+        # Callbacks de confirmação (PUBACK) por message id. O lock nunca é mantido
+        # durante client.publish(): o paho chama on_publish segurando o próprio mutex
+        # de saída, e a ordem inversa dos locks travaria a thread de rede.
+        # Confirmações que chegam antes do registro do callback ficam em _acked_mids.
+        self._publish_callbacks = {}
+        self._acked_mids = set()
+        self._publish_lock = threading.Lock()
         self._data_callback = None
-        # Dicionário para rastrear dispositivos e quando foram vistos pela última vez
-        self.online_devices: Dict[str, float] = {}
+        self._presence_callback = None
+        self._pipeline = None
+        # Registro dos dispositivos e de quando foram vistos pela última vez
+        self.registry = DeviceRegistry(settings.DEVICE_OFFLINE_TIMEOUT)
 
     def register_data_callback(self, callback):
         logging.info("Callback para tratamento de dados MQTT registrado.")
         self._data_callback = callback
 
+    def register_presence_callback(self, callback):
+        """Callback chamado com (device_id, timestamp) a cada mensagem 'hello'."""
+        self._presence_callback = callback
+
+    def register_pipeline(self, pipeline):
+        """Direciona as mensagens de dados para o pipeline de workers."""
+        logging.info("Pipeline de processamento MQTT registrado.")
+        self._pipeline = pipeline
+
     def _on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             logging.info(f"Conectado ao MQTT Broker em '{settings.MQTT_BROKER}' com sucesso!")
             # Inscreve-se nos tópicos de dados e de 'hello'
-            client.subscribe([(settings.MQTT_DATA_TOPIC, 0), (settings.MQTT_HELLO_TOPIC, 0)])
-            logging.info(f"Inscrito nos tópicos: '{settings.MQTT_DATA_TOPIC}' e '{settings.MQTT_HELLO_TOPIC}'")
+            if self.topics:
+                client.subscribe(self.topics)
+                logging.info(f"Inscrito nos tópicos: {', '.join(topic for topic, _ in self.topics)}")
         else:
             logging.error(f"Falha na conexão com MQTT, código de retorno: {rc}")
 
@@ -34,32 +59,41 @@ class MqttService:
 
             device_id = topic_parts[1]
             topic_type = topic_parts[2] if len(topic_parts) > 2 else ""
+            MESSAGES_RECEIVED.labels(topic_type=topic_type or "unknown").inc()
 
             # [cite_start]Se a mensagem for no tópico 'hello', atualizamos o status do dispositivo [cite: 28]
             if topic_type == 'hello':
-                self.online_devices[device_id] = time.time()
-                logging.info(f"Dispositivo '{device_id}' está online. Total online: {len(self.get_online_devices())}")
+                seen_at = time.time()
+                self.registry.touch(device_id, seen_at)
+                if self._presence_callback:
+                    self._presence_callback(device_id, seen_at)
+                log_sampled("Dispositivo '%s' está online. Total online: %s", device_id, self.registry.count())
 
             # [cite_start]Se for no tópico de 'data', processamos os dados [cite: 30]
             elif topic_type == 'data':
-                payload = msg.payload.decode()
-                logging.info(f"Mensagem de dados recebida de '{device_id}': {payload}")
-                if self._data_callback:
-                    self._data_callback(device_id, payload)
+                if self._pipeline:
+                    # Apenas enfileira a mensagem bruta; o parse e o envio ocorrem nos workers
+                    self._pipeline.submit(device_id, (msg.topic, msg.payload, time.time()))
+                else:
+                    self.dispatch_data(msg.topic, msg.payload, time.time())
         
         except Exception as e:
             logging.error(f"Erro ao processar mensagem MQTT: {e}")
+
+    def dispatch_data(self, topic: str, raw_payload: bytes, recv_ts: float):
+        """Decodifica uma mensagem de dados bruta e a entrega ao callback registrado."""
+        device_id = topic.split('/')[1]
+        payload = raw_payload.decode()
+        log_sampled("Mensagem de dados recebida de '%s': %s", device_id, payload)
+        if self._data_callback:
+            self._data_callback(device_id, payload, recv_ts)
     
     def get_online_devices(self) -> Dict[str, float]:
-        """Retorna uma lista de IDs de dispositivos considerados online."""
-        now = time.time()
-        # Filtra apenas os dispositivos que deram sinal de vida recentemente
-        active_devices = {
-            dev_id: last_seen for dev_id, last_seen in self.online_devices.items()
-            if (now - last_seen) < settings.DEVICE_OFFLINE_TIMEOUT
-        }
-        self.online_devices = active_devices # Limpa a lista de dispositivos antigos
-        return active_devices
+        """Retorna os dispositivos considerados online e quando foram vistos."""
+        return self.registry.snapshot()
+
+    def is_online(self, device_id: str) -> bool:
+        return self.registry.is_online(device_id)
 
     def connect(self):
         logging.info(f"Conectando ao MQTT Broker {settings.MQTT_BROKER}:{settings.MQTT_PORT}...")
@@ -70,12 +104,53 @@ class MqttService:
         logging.info("Iniciando o loop de escuta MQTT em segundo plano.")
         self.client.loop_start()
 
+    def _on_publish(self, client, userdata, mid):
+        with self._publish_lock:
+            callback = self._publish_callbacks.pop(mid, None)
+            if callback is None:
+                self._acked_mids.add(mid)
+        if callback:
+            callback()
+
+    def _register_publish(self, mid: int, on_ack=None):
+        """
+        Associa o callback ao message id depois que publish() retornou. Todas as
+        publicações passam por aqui, para que nenhum mid confirmado fique em
+        _acked_mids e seja confundido com uma publicação futura que reutilize o id.
+        """
+        with self._publish_lock:
+            acked = mid in self._acked_mids
+            if acked:
+                self._acked_mids.discard(mid)
+            elif on_ack:
+                self._publish_callbacks[mid] = on_ack
+            else:
+                # Sem callback: apenas consome a confirmação quando ela chegar
+                self._publish_callbacks[mid] = lambda: None
+        if acked and on_ack:
+            on_ack()
+
+    def publish_command_tracked(self, device_id: str, command: str, qos: int, on_ack):
+        """
+        Publica um comando e registra 'on_ack' para ser chamado quando o broker
+        confirmar a entrega (QoS 1/2) ou a mensagem for enviada (QoS 0).
+        Retorna True se a mensagem foi aceita pelo cliente MQTT.
+        """
+        command_topic = f"devices/{device_id}/commands"
+        result = self.client.publish(command_topic, command, qos=qos)
+        if result.rc != mqtt.MQTT_ERR_SUCCESS:
+            logging.error(f"Falha ao enviar comando para o tópico '{command_topic}'. Código: {result.rc}")
+            return False
+        self._register_publish(result.mid, on_ack)
+        return True
+
     def send_command(self, device_id: str, command: str):
         # A lógica de envio de comando permanece a mesma
         command_topic = f"devices/{device_id}/commands"
         result = self.client.publish(command_topic, command)
         
         if result.rc == mqtt.MQTT_ERR_SUCCESS:
+            self._register_publish(result.mid)
             logging.info(f"Comando '{command}' enviado com sucesso para o tópico '{command_topic}'.")
             return True
         else:
@@ -0,0 +1,105 @@
+import logging
+import threading
+import zlib
+from collections import deque
+from app import settings
+from app.metrics import MESSAGES_DROPPED, DropLogger
+
+class _Shard:
+    """Buffer circular limitado atendido por um único worker."""
+    def __init__(self, capacity: int):
+        self.buffer = deque(maxlen=capacity)
+        self.cond = threading.Condition()
+
+class PipelineService:
+    """
+    Desacopla a thread de rede do MQTT do processamento das mensagens.
+
+    O callback do paho apenas enfileira a mensagem bruta; um pool de workers
+    consome os buffers e executa o handler (parse + envio ao Kafka).
+    As mensagens são distribuídas entre os workers pela chave (device_id),
+    preservando a ordem de chegada por dispositivo.
+    """
+    def __init__(self, handler, workers: int = None, capacity: int = None):
+        self.handler = handler
+        self.workers = max(1, workers or settings.PIPELINE_WORKERS)
+        self.capacity = capacity or settings.PIPELINE_QUEUE_SIZE
+        shard_capacity = max(1, self.capacity // self.workers)
+        self._shards = [_Shard(shard_capacity) for _ in range(self.workers)]
+        self._threads = []
+        self._running = False
+
+        self._stats_lock = threading.Lock()
+        self.received_count = 0
+        self.processed_count = 0
+        self.dropped_count = 0
+        self.error_count = 0
+        self._drop_logger = DropLogger("Buffer do pipeline cheio: %s mensagens mais antigas descartadas desde o último aviso.")
+
+    def start(self):
+        """Inicia as threads de processamento."""
+        self._running = True
+        for index, shard in enumerate(self._shards):
+            thread = threading.Thread(target=self._worker_loop, args=(shard,), name=f"pipeline-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logging.info(f"Pipeline iniciado com {self.workers} workers (capacidade {self.capacity}).")
+
+    def submit(self, key: str, item: tuple):
+        """
+        Enfileira um item sem bloquear. Se o buffer estiver cheio, o item
+        mais antigo é descartado para dar lugar ao novo.
+        """
+        shard = self._shards[zlib.crc32(key.encode('utf-8')) % self.workers]
+        with shard.cond:
+            dropped = len(shard.buffer) == shard.buffer.maxlen
+            shard.buffer.append(item)
+            shard.cond.notify()
+        with self._stats_lock:
+            self.received_count += 1
+            if dropped:
+                self.dropped_count += 1
+        if dropped:
+            MESSAGES_DROPPED.labels(stage="pipeline").inc()
+            self._drop_logger.record()
+
+    def _worker_loop(self, shard: _Shard):
+        while True:
+            with shard.cond:
+                while not shard.buffer and self._running:
+                    shard.cond.wait()
+                if not shard.buffer:
+                    return
+                item = shard.buffer.popleft()
+            try:
+                self.handler(*item)
+                with self._stats_lock:
+                    self.processed_count += 1
+            except Exception as e:
+                with self._stats_lock:
+                    self.error_count += 1
+                logging.error(f"Erro no worker do pipeline: {e}")
+
+    def get_stats(self) -> dict:
+        """Retorna profundidade atual dos buffers e contadores do pipeline."""
+        depth = sum(len(shard.buffer) for shard in self._shards)
+        with self._stats_lock:
+            return {
+                "workers": self.workers,
+                "capacity": self.capacity,
+                "depth": depth,
+                "received": self.received_count,
+                "processed": self.processed_count,
+                "dropped": self.dropped_count,
+                "errors": self.error_count,
+            }
+
+    def stop(self, timeout: float = 10.0):
+        """Sinaliza o encerramento e aguarda os workers esvaziarem os buffers."""
+        self._running = False
+        for shard in self._shards:
+            with shard.cond:
+                shard.cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        logging.info("Pipeline encerrado.")
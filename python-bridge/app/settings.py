@@ -8,6 +8,9 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.01)) # Fração das mensagens registradas no log DEBUG
+DROP_LOG_INTERVAL_SECONDS = float(os.getenv("DROP_LOG_INTERVAL_SECONDS", 10)) # Intervalo mínimo entre os avisos de descarte
+
 # Configurações MQTT
 MQTT_BROKER = os.getenv("MQTT_BROKER", "broker.hivemq.com")
 MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))
@@ -18,7 +21,39 @@ MQTT_HELLO_TOPIC = "devices/+/hello"
 # Configurações Kafka
 KAFKA_BROKER = os.getenv("KAFKA_BROKER", "localhost:9092")
 KAFKA_TOPIC_DATA = os.getenv("KAFKA_TOPIC", "iot-data")
+KAFKA_LINGER_MS = int(os.getenv("KAFKA_LINGER_MS", 20)) # Tempo que o produtor aguarda para agrupar mensagens em lote
+KAFKA_BATCH_SIZE = int(os.getenv("KAFKA_BATCH_SIZE", 65536)) # Tamanho máximo (bytes) de um lote por partição
+KAFKA_COMPRESSION = os.getenv("KAFKA_COMPRESSION", "lz4") # none, gzip, snappy, lz4 ou zstd
+KAFKA_QUEUE_MAX_MESSAGES = int(os.getenv("KAFKA_QUEUE_MAX_MESSAGES", 100000)) # Limite da fila interna do produtor
+KAFKA_BACKPRESSURE = os.getenv("KAFKA_BACKPRESSURE", "block") # 'block' espera espaço na fila, 'drop' descarta a mensagem
+KAFKA_BACKPRESSURE_TIMEOUT = float(os.getenv("KAFKA_BACKPRESSURE_TIMEOUT", 5.0)) # Segundos máximos de espera no modo 'block'
+KAFKA_FLUSH_TIMEOUT = float(os.getenv("KAFKA_FLUSH_TIMEOUT", 30.0)) # Segundos para esvaziar a fila no encerramento
+KAFKA_VALUE_FORMAT = os.getenv("KAFKA_VALUE_FORMAT", "json") # 'json' ou 'avro' (binário compacto via schema-registry)
+SCHEMA_REGISTRY_URL = os.getenv("SCHEMA_REGISTRY_URL", "http://schema-registry:8081")
+
+# Configurações do Pipeline (MQTT -> workers -> Kafka)
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", 4)) # Quantidade de workers que processam as mensagens
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 10000)) # Capacidade total dos buffers do pipeline
+
+# Configurações do modo multiprocesso
+BRIDGE_PROCESSES = int(os.getenv("BRIDGE_PROCESSES", 1)) # >1 inicia N processos de ingestão com assinatura compartilhada
+MQTT_SHARED_GROUP = os.getenv("MQTT_SHARED_GROUP", "bridge") # Grupo do '$share/<grupo>/...' (o broker precisa suportar)
+
+# Configurações da pré-agregação na borda
+AGGREGATION_ENABLED = os.getenv("AGGREGATION_ENABLED", "false").lower() == "true" # Emite agregados por janela
+AGGREGATION_WINDOW_SECONDS = int(os.getenv("AGGREGATION_WINDOW_SECONDS", 300)) # Janela fixa (5 minutos, igual ao Spark)
+AGGREGATION_GRACE_SECONDS = int(os.getenv("AGGREGATION_GRACE_SECONDS", 10)) # Espera por leituras atrasadas antes de fechar a janela
+KAFKA_TOPIC_AGGREGATES = os.getenv("KAFKA_TOPIC_AGGREGATES", "iot-aggregates")
+RAW_PASSTHROUGH = os.getenv("RAW_PASSTHROUGH", "true").lower() == "true" # Continua enviando as leituras brutas
+AGGREGATION_MAX_TEMPERATURE = float(os.getenv("AGGREGATION_MAX_TEMPERATURE", 40.0)) # Limite para percentOverTempLimit
+AGGREGATION_MAX_HUMIDITY = float(os.getenv("AGGREGATION_MAX_HUMIDITY", 80.0)) # Limite para percentOverHumLimit
 
+# Configurações de comandos em massa
+COMMAND_WORKERS = int(os.getenv("COMMAND_WORKERS", 16)) # Publicações MQTT simultâneas por job
+COMMAND_QOS = int(os.getenv("COMMAND_QOS", 1)) # QoS padrão dos comandos (1 = com confirmação do broker)
+COMMAND_ACK_TIMEOUT = float(os.getenv("COMMAND_ACK_TIMEOUT", 30.0)) # Segundos até considerar a confirmação perdida
+COMMAND_JOBS_MAX = int(os.getenv("COMMAND_JOBS_MAX", 1000)) # Quantidade de jobs mantidos em memória para consulta
+SILO_DEVICES_URL = os.getenv("SILO_DEVICES_URL", "http://nest-api:3000/devices/silo") # Dispositivos de um silo (NestJS)
 
 # Configurações da API
 API_HOST = "0.0.0.0"
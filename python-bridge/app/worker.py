@@ -0,0 +1,117 @@
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from app import settings
+from app.handlers import build_data_handler
+from app.metrics import QUEUE_DEPTH, mark_process_dead
+from app.services.mqtt_service import MqttService
+from app.services.kafka_service import KafkaService
+from app.services.pipeline_service import PipelineService
+
+def shared_topic(topic: str) -> str:
+    """Tópico de assinatura compartilhada: o broker entrega cada mensagem a um único membro do grupo."""
+    return f"$share/{settings.MQTT_SHARED_GROUP}/{topic}"
+
+def run_worker(index: int, presence_queue):
+    """
+    Processo de ingestão: assina os tópicos de dados e 'hello' no grupo
+    compartilhado, produz no Kafka com o próprio produtor e repassa os
+    'hello' recebidos ao processo da API.
+    """
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+
+    kafka_service = KafkaService()
+    if settings.AGGREGATION_ENABLED:
+        # Com '$share' as leituras de um dispositivo se dividem entre os workers: cada um
+        # fecharia uma janela parcial e a ordem por dispositivo se perderia
+        logging.warning(f"Worker #{index}: pré-agregação desativada no modo multiprocesso (BRIDGE_PROCESSES > 1); leituras brutas enviadas ao Kafka.")
+    mqtt_service = MqttService(topics=[
+        (shared_topic(settings.MQTT_DATA_TOPIC), 0),
+        (shared_topic(settings.MQTT_HELLO_TOPIC), 0),
+    ])
+    pipeline_service = PipelineService(handler=mqtt_service.dispatch_data)
+
+    mqtt_service.register_data_callback(build_data_handler(kafka_service))
+    mqtt_service.register_presence_callback(lambda device_id, seen_at: presence_queue.put((device_id, seen_at)))
+    pipeline_service.start()
+    mqtt_service.register_pipeline(pipeline_service)
+    mqtt_service.connect()
+    mqtt_service.start_background_loop()
+    logging.info(f"Worker de ingestão #{index} iniciado.")
+
+    # Profundidade das filas do worker, somada no GET /metrics do processo da API
+    while not stop_event.wait(5):
+        QUEUE_DEPTH.labels(queue="pipeline").set(pipeline_service.get_stats()["depth"])
+        QUEUE_DEPTH.labels(queue="kafka_producer").set(len(kafka_service.producer))
+    mqtt_service.client.loop_stop()
+    pipeline_service.stop()
+    kafka_service.close()
+    logging.info(f"Worker de ingestão #{index} encerrado.")
+
+class WorkerPool:
+    """
+    Mantém N processos de ingestão (um núcleo e um socket MQTT cada) e
+    consolida a presença dos dispositivos no registro do processo da API.
+    """
+    def __init__(self, processes: int, registry):
+        self.processes = processes
+        self.registry = registry
+        # 'spawn' evita herdar threads e o estado do librdkafka do processo pai
+        self._ctx = multiprocessing.get_context("spawn")
+        self.presence_queue = self._ctx.Queue()
+        self._workers = {}
+        self._running = False
+
+    def _spawn(self, index: int):
+        process = self._ctx.Process(target=run_worker, args=(index, self.presence_queue), name=f"bridge-worker-{index}", daemon=True)
+        process.start()
+        self._workers[index] = process
+
+    def start(self):
+        self._running = True
+        for index in range(self.processes):
+            self._spawn(index)
+        threading.Thread(target=self._presence_loop, daemon=True).start()
+        threading.Thread(target=self._monitor_loop, daemon=True).start()
+        logging.info(f"{self.processes} workers de ingestão iniciados (grupo '{settings.MQTT_SHARED_GROUP}').")
+
+    def _presence_loop(self):
+        while self._running:
+            try:
+                device_id, seen_at = self.presence_queue.get(timeout=1)
+                self.registry.touch(device_id, seen_at)
+            except queue.Empty:
+                continue
+            except Exception as e:
+                logging.error(f"Erro ao consolidar presença dos workers: {e}")
+
+    def _monitor_loop(self):
+        """Reinicia workers que terminaram inesperadamente."""
+        while self._running:
+            for index, process in list(self._workers.items()):
+                if not process.is_alive() and self._running:
+                    logging.error(f"Worker #{index} terminou (código {process.exitcode}). Reiniciando...")
+                    mark_process_dead(process.pid)
+                    self._spawn(index)
+            time.sleep(5)
+
+    def get_stats(self) -> dict:
+        return {
+            "processes": self.processes,
+            "alive": sum(1 for process in self._workers.values() if process.is_alive()),
+        }
+
+    def stop(self, timeout: float = 30.0):
+        """Encerra os workers, aguardando que esvaziem seus produtores."""
+        self._running = False
+        for process in self._workers.values():
+            process.terminate()
+        for process in self._workers.values():
+            process.join(timeout=timeout)
+            mark_process_dead(process.pid)
+        logging.info("Workers de ingestão encerrados.")
@@ -3,9 +3,9 @@ from kafka import KafkaProducer
 import json
 import time
 import threading
-import queue
 import logging
 import math
+import os
 
 # =========================
 # Logging
@@ -27,8 +27,88 @@ KAFKA_TOPIC = "iot-data"
 # Valor de calibração do MQ-135 (ajuste conforme seu sensor)
 R0 = 5500  # resistência do sensor em ar limpo (~400 ppm CO₂)
 
-# Buffer para mensagens que não puderam ser enviadas ao Kafka
-kafka_queue = queue.Queue(maxsize=1000)
+# Spill log em disco para mensagens que não puderam ser enviadas ao Kafka
+SPILL_DIR = os.getenv("SPILL_DIR", "./spill")
+SPILL_SEGMENT_BYTES = int(os.getenv("SPILL_SEGMENT_BYTES", 4 * 1024 * 1024))  # tamanho máximo de cada segmento
+SPILL_REPLAY_BATCH = int(os.getenv("SPILL_REPLAY_BATCH", 1000))  # mensagens por lote no replay
+
+# =========================
+# Spill log (append-only, em segmentos)
+# =========================
+class SpillLog:
+    """
+    Log append-only em disco dividido em arquivos de segmento.
+
+    Cada linha é uma mensagem JSON. Segmentos fechados são reenviados em
+    lote e removidos apenas depois que o Kafka confirma todas as mensagens,
+    então o conteúdo sobrevive a reinícios do processo (entrega at-least-once).
+    """
+    def __init__(self, directory, segment_bytes):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        self.active_file = None
+        self.active_size = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self.segments = sorted(
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory) if name.endswith(".log")
+        )
+        self.next_seq = self._seq_of(self.segments[-1]) + 1 if self.segments else 1
+        if self.segments:
+            logging.info(f"Spill log com {len(self.segments)} segmentos pendentes de reenvio.")
+
+    @staticmethod
+    def _seq_of(path):
+        return int(os.path.basename(path).split(".")[0])
+
+    def has_pending(self):
+        with self.lock:
+            return bool(self.segments)
+
+    def append(self, data):
+        """Grava a mensagem no segmento ativo, abrindo/rotacionando quando necessário."""
+        line = (json.dumps(data) + "\n").encode("utf-8")
+        with self.lock:
+            if self.active_file is None:
+                path = os.path.join(self.directory, f"{self.next_seq:012d}.log")
+                self.next_seq += 1
+                self.active_file = open(path, "ab")
+                self.active_size = 0
+                self.segments.append(path)
+            self.active_file.write(line)
+            self.active_file.flush()
+            self.active_size += len(line)
+            if self.active_size >= self.segment_bytes:
+                self._seal()
+
+    def _seal(self):
+        if self.active_file is not None:
+            os.fsync(self.active_file.fileno())
+            self.active_file.close()
+            self.active_file = None
+
+    def sealed_segments(self):
+        """Fecha o segmento ativo e retorna todos os segmentos prontos para replay."""
+        with self.lock:
+            self._seal()
+            return list(self.segments)
+
+    def read_segment(self, path):
+        records = []
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Linha incompleta (ex: queda durante a escrita), descartada
+                    logging.warning(f"Linha corrompida ignorada no segmento {path}.")
+        return records
+
+    def remove(self, path):
+        with self.lock:
+            self.segments.remove(path)
+        os.remove(path)
 
 # =========================
 # Serviço MQTT (somente dados)
@@ -80,11 +160,11 @@ class MQTTDataBridge:
 # Serviço Kafka (somente envio de dados)
 # =========================
 class KafkaDataBridge:
-    def __init__(self, broker, topic):
+    def __init__(self, broker, topic, spill):
         self.broker = broker
         self.topic = topic
+        self.spill = spill
         self.producer = None
-        self.connect()
 
     def connect(self):
         while True:
@@ -99,21 +179,51 @@ class KafkaDataBridge:
                 logging.error(f"Erro ao conectar ao Kafka: {e}. Tentando novamente em 5s...")
                 time.sleep(5)
 
+    def _on_send_error(self, data, exc):
+        logging.error(f"Erro ao enviar para Kafka, gravando no spill log: {exc}")
+        self.spill.append(data)
+
     def send(self, data):
+        # Enquanto houver mensagens no spill log, as novas vão para o final dele
+        # para preservar a ordem; sem Kafka disponível, também vão para o disco.
+        if self.producer is None or self.spill.has_pending():
+            self.spill.append(data)
+            return
         try:
-            self.producer.send(self.topic, data)
-            self.producer.flush()
+            future = self.producer.send(self.topic, data)
+            future.add_errback(self._on_send_error, data)
             logging.info(f"Dado enviado para Kafka: {data}")
         except Exception as e:
-            logging.error(f"Erro ao enviar para Kafka, adicionando ao buffer: {e}")
-            kafka_queue.put(data)
+            self._on_send_error(data, e)
+
+    def _replay_segment(self, path):
+        """Reenvia um segmento em lotes; retorna True se todas as mensagens foram confirmadas."""
+        records = self.spill.read_segment(path)
+        for start in range(0, len(records), SPILL_REPLAY_BATCH):
+            futures = [self.producer.send(self.topic, data) for data in records[start:start + SPILL_REPLAY_BATCH]]
+            self.producer.flush()
+            if any(f.failed() for f in futures):
+                return False
+        return True
 
     def retry_buffered_messages(self):
+        """Conecta ao Kafka em segundo plano e reenvia o spill log quando ele está acessível."""
+        self.connect()
         while True:
-            if not kafka_queue.empty():
-                data = kafka_queue.get()
-                self.send(data)
-            time.sleep(1)
+            for path in self.spill.sealed_segments():
+                try:
+                    if not self._replay_segment(path):
+                        logging.error(f"Falha no replay do segmento {path}, nova tentativa em 5s...")
+                        break
+                    self.spill.remove(path)
+                    logging.info(f"Segmento {path} reenviado ao Kafka.")
+                except Exception as e:
+                    logging.error(f"Erro no replay do segmento {path}: {e}. Nova tentativa em 5s...")
+                    break
+            else:
+                time.sleep(1)
+                continue
+            time.sleep(5)
 
 # =========================
 # Função para calcular CO₂ (ppm)
@@ -155,7 +265,8 @@ def mqtt_data_callback(device_id, payload):
 # Inicialização
 # =========================
 mqtt_bridge = MQTTDataBridge(MQTT_BROKER, MQTT_PORT)
-kafka_bridge = KafkaDataBridge(KAFKA_BROKER, KAFKA_TOPIC)
+spill_log = SpillLog(SPILL_DIR, SPILL_SEGMENT_BYTES)
+kafka_bridge = KafkaDataBridge(KAFKA_BROKER, KAFKA_TOPIC, spill_log)
 
 mqtt_bridge.register_callback(on_data=mqtt_data_callback)
 threading.Thread(target=kafka_bridge.retry_buffered_messages, daemon=True).start()
@@ -0,0 +1,108 @@
+"""
+Motor de agregação em NumPy, alternativo ao Spark (AGGREGATION_ENGINE=numpy).
+
+Calcula, por janela fixa de 5 minutos, as mesmas colunas de
+window_aggregations() em spark_data_process_service.py, com a semântica do
+Spark SQL:
+  - avg/min/max ignoram nulos e são nulos se a janela não tem valores;
+  - stddev é o desvio padrão amostral e é nulo com menos de 2 valores;
+  - percentOver*Limit divide pelo total de linhas da janela (count(*)),
+    e leituras nulas nunca contam como acima do limite;
+  - corr usa apenas linhas com os dois valores e é nulo com menos de 2
+    pares ou variância zero (divisão por zero no Spark resulta em nulo).
+
+Os valores coincidem com os do Spark dentro da tolerância de ponto flutuante,
+não bit a bit: aqui as somas são sequenciais (cumsum) sobre a janela inteira,
+enquanto avg/stddev/corr do Spark usam atualizações incrementais (estilo
+Welford) e combinam agregados parciais de cada partição.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+import numpy as np
+
+WINDOW_SECONDS = 300
+
+# Mesmo formato do struct 'window' do Spark (row["window"].start / .end)
+Window = namedtuple("Window", ["start", "end"])
+
+
+def _mean(values):
+    return np.cumsum(values)[-1] / len(values)
+
+
+def _stats(x):
+    valid = x[~np.isnan(x)]
+    n = len(valid)
+    if n == 0:
+        return None, None, None, None
+    mean = _mean(valid)
+    std = float(np.sqrt(np.cumsum((valid - mean) ** 2)[-1] / (n - 1))) if n > 1 else None
+    return float(mean), float(valid.min()), float(valid.max()), std
+
+
+def _corr(x, y):
+    both = ~np.isnan(x) & ~np.isnan(y)
+    if both.sum() < 2:
+        return None
+    dx = x[both] - _mean(x[both])
+    dy = y[both] - _mean(y[both])
+    denominator = np.sqrt(np.cumsum(dx * dx)[-1] * np.cumsum(dy * dy)[-1])
+    if denominator == 0:
+        return None
+    return float(np.cumsum(dx * dy)[-1] / denominator)
+
+
+def _percent_over(x, limit, total):
+    # Comparações com NaN são falsas, como 'when(col > limite)' com nulo no Spark
+    return float(np.count_nonzero(x > limit)) / total * 100
+
+
+def aggregate_columns(columns: dict, max_temp: float, max_hum: float, window_seconds: int = WINDOW_SECONDS) -> list:
+    """
+    Agrega as colunas de um dispositivo (timestamp, temperature, humidity e
+    co2_ppm, com NaN para valores ausentes; ver timeseries_reader.decode_members)
+    por janela e retorna uma lista de dicts com as mesmas chaves das linhas de
+    grouped.collect() no Spark (valores iguais dentro da tolerância de ponto
+    flutuante; ver o docstring do módulo).
+    """
+    timestamps = np.asarray(columns["timestamp"], dtype=np.int64)
+    if len(timestamps) == 0:
+        return []
+
+    order = np.argsort(timestamps, kind="stable")
+    timestamps = timestamps[order]
+    temperature = np.asarray(columns["temperature"], dtype=np.float64)[order]
+    humidity = np.asarray(columns["humidity"], dtype=np.float64)[order]
+    co2 = np.asarray(columns["co2_ppm"], dtype=np.float64)[order]
+
+    starts = timestamps - timestamps % window_seconds
+    bounds = np.flatnonzero(np.diff(starts)) + 1
+    rows = []
+    for lo, hi in zip(np.concatenate(([0], bounds)), np.concatenate((bounds, [len(starts)]))):
+        t, h, c = temperature[lo:hi], humidity[lo:hi], co2[lo:hi]
+        total = int(hi - lo)
+        avg_t, min_t, max_t, std_t = _stats(t)
+        avg_h, min_h, max_h, std_h = _stats(h)
+        avg_c, _, _, std_c = _stats(c)
+        start = int(starts[lo])
+        rows.append({
+            # Datetime local sem fuso, como o Spark converte o struct da janela
+            "window": Window(datetime.fromtimestamp(start), datetime.fromtimestamp(start + window_seconds)),
+            "averageTemperature": avg_t,
+            "averageHumidity": avg_h,
+            "averageAirQuality": avg_c,
+            "maxTemperature": max_t,
+            "minTemperature": min_t,
+            "maxHumidity": max_h,
+            "minHumidity": min_h,
+            "stdTemperature": std_t,
+            "stdHumidity": std_h,
+            "stdAirQuality": std_c,
+            "percentOverTempLimit": _percent_over(t, max_temp, total),
+            "percentOverHumLimit": _percent_over(h, max_hum, total),
+            "corrTempHum": _corr(t, h),
+            "corrTempAir": _corr(t, c),
+            "corrHumAir": _corr(h, c),
+        })
+    return rows
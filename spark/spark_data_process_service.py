@@ -1,16 +1,21 @@
 import redis
-import json
 import requests
 import time
 import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
 from datetime import datetime
 from pyspark.sql import SparkSession
 from pyspark.sql.functions import (
-    col, avg, max, min, stddev, count, when, window, corr
+    col, avg, max, min, stddev, count, when, window, corr, broadcast, isnan, lit
 )
 from pyspark.sql.types import StructType, StructField, StringType, DoubleType, LongType
 import os
 from spoilage_model import GrainSpoilagePredictor
+import numpy as np
+import pandas as pd
+from timeseries_reader import decode_members, mq135_to_co2_ppm_array
+from numpy_engine import aggregate_columns
 
 
 # CONFIGURAÇÕES
@@ -31,34 +36,29 @@ DEVICE_TO_SILO = {
 
 #  Limites removidos daqui, serão buscados da API
 PROCESS_INTERVAL = 300   # 5 minutos
+# "batch": um único job Spark por ciclo para todos os dispositivos; "per_device": um job por dispositivo
+CYCLE_MODE = os.getenv("SPARK_CYCLE_MODE", "batch")
+# Motor de agregação: "spark" ou "numpy" (por dispositivo, sem JVM; o Spark fica para backfills grandes)
+AGGREGATION_ENGINE = os.getenv("AGGREGATION_ENGINE", "spark")
+# Cache da configuração dos silos: validade (s) e timeout das chamadas à API (s)
+SILO_CONFIG_TTL = int(os.getenv("SILO_CONFIG_TTL", 600))
+SILO_CONFIG_TIMEOUT = float(os.getenv("SILO_CONFIG_TIMEOUT", 5))
 CHECK_INTERVAL = 120     # 2 minutos
 
 
-# FUNÇÃO MQ135 → CO2 (ppm)
+# INICIALIZA SPARK (sob demanda: com AGGREGATION_ENGINE=numpy a JVM não é iniciada)
 
-def mq135_to_co2_ppm(rs, r0=1040):
-    """
-    Converte a resistência Rs (ohms) do MQ135 em CO2 (ppm aproximado).
-    Curva empírica baseada em gráficos de datasheet e calibrações comuns.
-    """
-    if not rs or rs <= 0 or not r0 or r0 <= 0:
-        return None
-    try:
-        ratio = rs / r0
-        # Curva para CO₂ (aproximação logarítmica)
-        a = -0.42
-        b = 1.92
-        ppm = math.pow(10, ((math.log10(ratio) - b) / a))
-        return round(ppm, 2)
-    except Exception:
-        return None
+_spark = None
 
 
-# INICIALIZA SPARK
-
-spark = SparkSession.builder \
-    .appName("MultiSiloDataProcess-Service") \
-    .getOrCreate()
+def get_spark():
+    global _spark
+    if _spark is None:
+        _spark = SparkSession.builder \
+            .appName("MultiSiloDataProcess-Service") \
+            .config("spark.sql.execution.arrow.pyspark.enabled", "true") \
+            .getOrCreate()
+    return _spark
 
 
 # CONEXÃO REDIS
@@ -70,6 +70,14 @@ r = redis.StrictRedis(
     decode_responses=True
 )
 
+# Cliente binário para o histórico: os membros podem estar comprimidos (HISTORY_COMPRESSION)
+r_bin = redis.StrictRedis(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    password=REDIS_PASSWORD,
+    decode_responses=False
+)
+
 
 # VERIFICA SE O SILO ESTÁ PRONTO
 
@@ -91,204 +99,366 @@ def wait_for_silo_ready(silo_id: int):
         time.sleep(CHECK_INTERVAL)
 
 
-# FUNÇÃO DE PROCESSAMENTO (COM CORRELAÇÃO E SPOILAGE RISK)
+# HELPERS DE PROCESSAMENTO
+
+def sanitize_float(value, default=0.0):
+    """Converte None, NaN, ou Inf para um valor float padrão."""
+    if value is None or math.isnan(value) or math.isinf(value):
+        return default
+    return float(value)
+
+
+def read_columns(raw_data) -> dict:
+    """Decodifica membros do histórico em colunas NumPy, com o CO2 calculado sobre o array inteiro."""
+    columns = decode_members(raw_data)
+    columns["co2_ppm"] = mq135_to_co2_ppm_array(columns.pop("mq_rs"))
+    return columns
+
+
+READINGS_SCHEMA = StructType([
+    StructField("device_id", StringType(), True),
+    StructField("timestamp", LongType(), True),
+    StructField("temperature", DoubleType(), True),
+    StructField("humidity", DoubleType(), True),
+    StructField("co2_ppm", DoubleType(), True),
+])
+
+
+def readings_dataframe(spark, device_ids, columns: dict):
+    """
+    Cria o DataFrame de leituras direto das colunas NumPy (via pandas/Arrow),
+    sem montar um dict por linha. NaN volta a ser nulo, como no parse por linha.
+    """
+    pdf = pd.DataFrame({
+        "device_id": device_ids,
+        "timestamp": columns["timestamp"],
+        "temperature": columns["temperature"],
+        "humidity": columns["humidity"],
+        "co2_ppm": columns["co2_ppm"],
+    })
+    df = spark.createDataFrame(pdf, READINGS_SCHEMA)
+    for name in ("temperature", "humidity", "co2_ppm"):
+        df = df.withColumn(name, when(isnan(col(name)), lit(None)).otherwise(col(name)))
+    return df.withColumn("timestamp", col("timestamp").cast("timestamp"))
+
+
+def window_aggregations(max_temp, max_hum):
+    """Agregações da janela de 5 minutos; os limites podem ser valores fixos ou colunas."""
+    return [
+        # Médias, Max, Min, etc.
+        avg("temperature").alias("averageTemperature"),
+        avg("humidity").alias("averageHumidity"),
+        avg("co2_ppm").alias("averageAirQuality"),
+        max("temperature").alias("maxTemperature"),
+        min("temperature").alias("minTemperature"),
+        max("humidity").alias("maxHumidity"),
+        min("humidity").alias("minHumidity"),
+        stddev("temperature").alias("stdTemperature"),
+        stddev("humidity").alias("stdHumidity"),
+        stddev("co2_ppm").alias("stdAirQuality"),
+        (count(when(col("temperature") > max_temp, True)) / count("*") * 100).alias("percentOverTempLimit"),
+        (count(when(col("humidity") > max_hum, True)) / count("*") * 100).alias("percentOverHumLimit"),
+
+        # Adicionando cálculos de correlação
+        corr("temperature", "humidity").alias("corrTempHum"),
+        corr("temperature", "co2_ppm").alias("corrTempAir"),
+        corr("humidity", "co2_ppm").alias("corrHumAir")
+    ]
+
+
+def send_window(device_key: str, silo_id: int, row):
+    """Monta o DTO de uma janela agregada (com spoilage risk) e envia para a API."""
+    period_start = row["window"].start
+    period_end = row["window"].end
+
+    percent_over_temp = sanitize_float(row["percentOverTempLimit"])
+    percent_over_hum = sanitize_float(row["percentOverHumLimit"])
+    std_air_quality = sanitize_float(row["stdAirQuality"])
+
+    environmentScore = 100 - (
+        (percent_over_temp) * 0.3 +
+        (percent_over_hum) * 0.3 +
+        (std_air_quality / 10) * 0.4 
+    )
+
+    # Coletando os valores de correlação
+    # O sanitize_float é crucial aqui, pois corr() pode retornar NaN
+    corr_temp_hum = sanitize_float(row["corrTempHum"])
+    corr_temp_air = sanitize_float(row["corrTempAir"])
+    corr_hum_air = sanitize_float(row["corrHumAir"])
+    spoilage_risk_prob = None
+    risk_category = None
+    emoji = ""
+    action = ""
+
+    try:
+        aggregated_data = {
+            'averageTemperature': sanitize_float(row["averageTemperature"]),
+            'averageHumidity': sanitize_float(row["averageHumidity"]),
+            'averageAirQuality': sanitize_float(row["averageAirQuality"]),
+            'stdTemperature': sanitize_float(row["stdTemperature"]),
+            'stdHumidity': sanitize_float(row["stdHumidity"]),
+            'percentOverTempLimit': percent_over_temp,
+            'percentOverHumLimit': percent_over_hum,
+        }
+
+        spoilage_risk_prob = spoilage_predictor.predict_spoilage_risk(aggregated_data)
+        risk_category, emoji, action = spoilage_predictor.get_risk_category(spoilage_risk_prob)
+
+    except Exception as e:
+        print(f" Erro ao calcular spoilage risk para {device_key}: {repr(e)}")
+        print(f"    → Continuando sem dados de spoilage (será ignorado)")
+        spoilage_risk_prob = None
+        risk_category = None
+
+
+    # ====== CONSTRUIR DTO COM VALIDAÇÃO ======
+    dto = {
+        "siloId": silo_id,
+        "periodStart": period_start.isoformat(),
+        "periodEnd": period_end.isoformat(),
+        "averageTemperature": sanitize_float(row["averageTemperature"]),
+        "averageHumidity": sanitize_float(row["averageHumidity"]),
+        "averageAirQuality": sanitize_float(row["averageAirQuality"]),
+        "maxTemperature": sanitize_float(row["maxTemperature"]),
+        "minTemperature": sanitize_float(row["minTemperature"]),
+        "maxHumidity": sanitize_float(row["maxHumidity"]),
+        "minHumidity": sanitize_float(row["minHumidity"]),
+        "stdTemperature": sanitize_float(row["stdTemperature"]),
+        "stdHumidity": sanitize_float(row["stdHumidity"]),
+        "stdAirQuality": std_air_quality,
+        "percentOverTempLimit": percent_over_temp,
+        "percentOverHumLimit": percent_over_hum,
+        "environmentScore": sanitize_float(environmentScore),
+        "alertsCount": corr_temp_hum,
+        "criticalAlertsCount": corr_temp_air,
+    }
+
+    # Adicionar spoilage APENAS se calculado com sucesso
+    if spoilage_risk_prob is not None and risk_category is not None:
+        dto["spoilageRiskProbability"] = spoilage_risk_prob
+        dto["spoilageRiskCategory"] = risk_category
+    else:
+        print(f" ℹSpoilage risk não será enviado para este período")
+    # ========================================
+
+    try:
+        res = requests.post(API_URL, json=dto)
+
+        if 200 <= res.status_code < 300:
+            print(f" [{device_key}] {period_start} → {period_end}")
+            print(f"   ├─ Status: {res.status_code} (Salvo!)")
+            if spoilage_risk_prob is not None:
+                print(f"   ├─ Spoilage Risk: {emoji} {risk_category} ({spoilage_risk_prob:.1%})")
+                print(f"   └─ Ação: {action}")
+            else:
+                print(f"   └─ (sem dados de spoilage)")
+        else:
+            print(f" [{device_key}] API Rejeitou {period_start} → {period_end} | {res.status_code}")
+            try:
+                print(f"   └── Motivo: {res.json()}") 
+            except:
+                print(f"   └── Motivo: {res.text}")
+
+    except Exception as e:
+        print(f" Falha ao ENVIAR dados do {device_key}: {repr(e)}")
+
+
+# FUNÇÃO DE PROCESSAMENTO POR DISPOSITIVO (COM CORRELAÇÃO E SPOILAGE RISK)
 
 def process_device(device_key: str, silo_id: int, min_timestamp: int, silo_config: dict):
-    
-    # Helper para converter NaN, Inf e None para float
-    
-    def sanitize_float(value, default=0.0):
-        """Converte None, NaN, ou Inf para um valor float padrão."""
-        if value is None or math.isnan(value) or math.isinf(value):
-            return default
-        return float(value)
-        
     try:
-        raw_data = r.zrangebyscore(device_key, min_timestamp, "+inf")
+        raw_data = r_bin.zrangebyscore(device_key, min_timestamp, "+inf")
         if not raw_data:
             print(f" Nenhum dado novo em {device_key}")
             return
 
-        data = []
-        for record_json in raw_data:
-            record = json.loads(record_json)
-            
-            payload_data = record.get("payload", "{}")
-            payload = {}
-            
-            if isinstance(payload_data, str):
-                try:
-                    payload = json.loads(payload_data)
-                except json.JSONDecodeError:
-                    print(f" Falha ao decodificar payload string: {payload_data}")
-                    payload = {} 
-            elif isinstance(payload_data, dict):
-                payload = payload_data
-            else:
-                try:
-                    payload = json.loads("{}")
-                except:
-                    payload = {}
-
-            co2_ppm = mq135_to_co2_ppm(payload.get("mq_rs", 0))
-
-            try:
-                temp = float(payload.get("temperature"))
-            except (ValueError, TypeError):
-                temp = None
-            
-            try:
-                hum = float(payload.get("humidity"))
-            except (ValueError, TypeError):
-                hum = None
-
-            data.append({
-                "device_id": record.get("device_id"),
-                "timestamp": record.get("timestamp"),
-                "temperature": temp,
-                "humidity": hum,
-                "co2_ppm": co2_ppm,
-            })
-
-        if not data:
+        columns = read_columns(raw_data)
+        if len(columns["timestamp"]) == 0:
             print(f"ℹ Nenhum dado válido para processar em {device_key} após o parse.")
             return
 
-        schema = StructType([
-            StructField("device_id", StringType(), True),
-            StructField("timestamp", LongType(), True),
-            StructField("temperature", DoubleType(), True),
-            StructField("humidity", DoubleType(), True),
-            StructField("co2_ppm", DoubleType(), True),
-        ])
+        # A API pode devolver o limite como null: usa o padrão, como em process_cycle
+        max_temp = float(silo_config.get("maxTemperature") or 40.0)
+        max_hum = float(silo_config.get("maxHumidity") or 80.0)
 
-        df = spark.createDataFrame(data, schema)
-        df = df.withColumn("timestamp", col("timestamp").cast("timestamp"))
-        
-        max_temp = silo_config.get("maxTemperature", 40.0)
-        max_hum = silo_config.get("maxHumidity", 80.0)
+        if AGGREGATION_ENGINE == "numpy":
+            rows = aggregate_columns(columns, max_temp, max_hum)
+        else:
+            device_id = device_key.split(":")[-1]
+            df = readings_dataframe(get_spark(), np.full(len(columns["timestamp"]), device_id, dtype=object), columns)
 
-        grouped = df.groupBy(
-            window(col("timestamp"), "5 minutes")
-        ).agg(
-            # Médias, Max, Min, etc.
-            avg("temperature").alias("averageTemperature"),
-            avg("humidity").alias("averageHumidity"),
-            avg("co2_ppm").alias("averageAirQuality"),
-            max("temperature").alias("maxTemperature"),
-            min("temperature").alias("minTemperature"),
-            max("humidity").alias("maxHumidity"),
-            min("humidity").alias("minHumidity"),
-            stddev("temperature").alias("stdTemperature"),
-            stddev("humidity").alias("stdHumidity"),
-            stddev("co2_ppm").alias("stdAirQuality"),
-            (count(when(col("temperature") > max_temp, True)) / count("*") * 100).alias("percentOverTempLimit"),
-            (count(when(col("humidity") > max_hum, True)) / count("*") * 100).alias("percentOverHumLimit"),
-            
-            # Adicionando cálculos de correlação
-            corr("temperature", "humidity").alias("corrTempHum"),
-            corr("temperature", "co2_ppm").alias("corrTempAir"),
-            corr("humidity", "co2_ppm").alias("corrHumAir")
-        )
+            grouped = df.groupBy(
+                window(col("timestamp"), "5 minutes")
+            ).agg(*window_aggregations(max_temp, max_hum))
+            rows = grouped.collect()
 
-        for row in grouped.collect():
-            period_start = row["window"].start
-            period_end = row["window"].end
-            
-            percent_over_temp = sanitize_float(row["percentOverTempLimit"])
-            percent_over_hum = sanitize_float(row["percentOverHumLimit"])
-            std_air_quality = sanitize_float(row["stdAirQuality"])
-
-            environmentScore = 100 - (
-                (percent_over_temp) * 0.3 +
-                (percent_over_hum) * 0.3 +
-                (std_air_quality / 10) * 0.4 
-            )
-            
-            # Coletando os valores de correlação
-            # O sanitize_float é crucial aqui, pois corr() pode retornar NaN
-            corr_temp_hum = sanitize_float(row["corrTempHum"])
-            corr_temp_air = sanitize_float(row["corrTempAir"])
-            corr_hum_air = sanitize_float(row["corrHumAir"])
-            spoilage_risk_prob = None
-            risk_category = None
-            emoji = ""
-            action = ""
-            
-            try:
-                aggregated_data = {
-                    'averageTemperature': sanitize_float(row["averageTemperature"]),
-                    'averageHumidity': sanitize_float(row["averageHumidity"]),
-                    'averageAirQuality': sanitize_float(row["averageAirQuality"]),
-                    'stdTemperature': sanitize_float(row["stdTemperature"]),
-                    'stdHumidity': sanitize_float(row["stdHumidity"]),
-                    'percentOverTempLimit': percent_over_temp,
-                    'percentOverHumLimit': percent_over_hum,
-                }
-                
-                spoilage_risk_prob = spoilage_predictor.predict_spoilage_risk(aggregated_data)
-                risk_category, emoji, action = spoilage_predictor.get_risk_category(spoilage_risk_prob)
-                
-            except Exception as e:
-                print(f" Erro ao calcular spoilage risk para {device_key}: {repr(e)}")
-                print(f"    → Continuando sem dados de spoilage (será ignorado)")
-                spoilage_risk_prob = None
-                risk_category = None
-           
-
-            # ====== CONSTRUIR DTO COM VALIDAÇÃO ======
-            dto = {
-                "siloId": silo_id,
-                "periodStart": period_start.isoformat(),
-                "periodEnd": period_end.isoformat(),
-                "averageTemperature": sanitize_float(row["averageTemperature"]),
-                "averageHumidity": sanitize_float(row["averageHumidity"]),
-                "averageAirQuality": sanitize_float(row["averageAirQuality"]),
-                "maxTemperature": sanitize_float(row["maxTemperature"]),
-                "minTemperature": sanitize_float(row["minTemperature"]),
-                "maxHumidity": sanitize_float(row["maxHumidity"]),
-                "minHumidity": sanitize_float(row["minHumidity"]),
-                "stdTemperature": sanitize_float(row["stdTemperature"]),
-                "stdHumidity": sanitize_float(row["stdHumidity"]),
-                "stdAirQuality": std_air_quality,
-                "percentOverTempLimit": percent_over_temp,
-                "percentOverHumLimit": percent_over_hum,
-                "environmentScore": sanitize_float(environmentScore),
-                "alertsCount": corr_temp_hum,
-                "criticalAlertsCount": corr_temp_air,
-            }
-            
-            # Adicionar spoilage APENAS se calculado com sucesso
-            if spoilage_risk_prob is not None and risk_category is not None:
-                dto["spoilageRiskProbability"] = spoilage_risk_prob
-                dto["spoilageRiskCategory"] = risk_category
-            else:
-                print(f" ℹSpoilage risk não será enviado para este período")
-            # ========================================
+        for row in rows:
+            send_window(device_key, silo_id, row)
+
+    except Exception as e:
+        print(f" Erro processando {device_key}: {repr(e)}")
+
+
+# CICLO ÚNICO PARA TODOS OS DISPOSITIVOS
+
+def process_cycle(device_silos: dict, min_timestamp: int, silo_configs: dict):
+    """
+    Processa todos os dispositivos do ciclo em um único job: as leituras novas
+    são lidas com um pipeline do Redis, carregadas em um só DataFrame e agregadas
+    com groupBy(device_id, window). Os limites de cada silo entram por um join
+    com uma tabela pequena em broadcast.
+
+    Um dispositivo com registros ilegíveis é ignorado sem perder o ciclo dos
+    demais. Retorna False se o job do ciclo falhar, para que o intervalo seja
+    reprocessado no próximo ciclo.
+    """
+    try:
+        device_ids = list(device_silos)
+        pipe = r_bin.pipeline(transaction=False)
+        for device_id in device_ids:
+            pipe.zrangebyscore(f"device:history:{device_id}", min_timestamp, "+inf")
 
+        parts = []
+        for device_id, raw_data in zip(device_ids, pipe.execute()):
             try:
-                res = requests.post(API_URL, json=dto)
-                
-                if 200 <= res.status_code < 300:
-                    print(f" [{device_key}] {period_start} → {period_end}")
-                    print(f"   ├─ Status: {res.status_code} (Salvo!)")
-                    if spoilage_risk_prob is not None:
-                        print(f"   ├─ Spoilage Risk: {emoji} {risk_category} ({spoilage_risk_prob:.1%})")
-                        print(f"   └─ Ação: {action}")
-                    else:
-                        print(f"   └─ (sem dados de spoilage)")
-                else:
-                    print(f" [{device_key}] API Rejeitou {period_start} → {period_end} | {res.status_code}")
-                    try:
-                        print(f"   └── Motivo: {res.json()}") 
-                    except:
-                        print(f"   └── Motivo: {res.text}")
-                        
+                columns = read_columns(raw_data)
             except Exception as e:
-                print(f" Falha ao ENVIAR dados do {device_key}: {repr(e)}")
+                print(f" Erro ao ler o histórico de {device_id}: {repr(e)}. Dispositivo ignorado no ciclo.")
+                continue
+            # O índice do histórico é a fonte do device_id, mesmo que o registro não o traga
+            parts.append((np.full(len(columns["timestamp"]), device_id, dtype=object), columns))
+        total = sum(len(ids) for ids, _ in parts)
+        if total == 0:
+            print(" Nenhum dado novo no ciclo.")
+            return True
+        device_column = np.concatenate([ids for ids, _ in parts])
+        columns = {name: np.concatenate([part[name] for _, part in parts]) for name in parts[0][1]}
+
+        spark = get_spark()
+        limits = spark.createDataFrame(
+            [
+                (device_id, silo_id,
+                 float(silo_configs.get(silo_id, {}).get("maxTemperature") or 40.0),
+                 float(silo_configs.get(silo_id, {}).get("maxHumidity") or 80.0))
+                for device_id, silo_id in device_silos.items()
+            ],
+            StructType([
+                StructField("device_id", StringType(), False),
+                StructField("silo_id", LongType(), False),
+                StructField("limitTemperature", DoubleType(), True),
+                StructField("limitHumidity", DoubleType(), True),
+            ])
+        )
+
+        df = readings_dataframe(spark, device_column, columns)
+        df = df.join(broadcast(limits), on="device_id")
+
+        grouped = df.groupBy(
+            "device_id", "silo_id", window(col("timestamp"), "5 minutes")
+        ).agg(*window_aggregations(col("limitTemperature"), col("limitHumidity")))
+
+        rows = grouped.collect()
+        print(f" {total} leituras de {len(device_ids)} dispositivos agregadas em {len(rows)} janelas.")
+        for row in rows:
+            send_window(f"device:history:{row['device_id']}", row["silo_id"], row)
+        return True
 
     except Exception as e:
-        print(f" Erro processando {device_key}: {repr(e)}")
+        print(f" Erro no ciclo de processamento: {repr(e)}")
+        return False
+
+
+# DISPOSITIVOS COM DADOS NOVOS
+
+def devices_with_new_data(since: int):
+    """
+    Lê o índice devices:last_seen (mantido pelo kafka-redis-consumer) e retorna
+    apenas os dispositivos com leituras desde 'since'. Sem índice (consumidor
+    antigo), percorre as chaves com SCAN, que não bloqueia o Redis como KEYS.
+    """
+    if r.exists("devices:last_seen"):
+        return r.zrangebyscore("devices:last_seen", since, "+inf")
+    print(" Índice devices:last_seen ausente, usando SCAN...")
+    return [key.split(":")[-1] for key in r.scan_iter(match="device:history:*", count=1000)]
+
+
+# CONFIGURAÇÃO DO SILO (CACHE COM TTL)
+
+class SiloConfigCache:
+    """
+    Cache da configuração dos silos (GET SILO_API_URL/{id}).
+
+    - Dentro do TTL, a configuração vem do cache, sem ir à API.
+    - Vencido o TTL, o valor antigo é usado no ciclo atual e a revalidação roda
+      em segundo plano (stale-while-revalidate), com If-None-Match quando a API
+      devolveu um ETag (304 apenas renova o prazo).
+    - Silos ainda sem configuração são buscados em paralelo, com timeout.
+    - Se a API falhar, vale a última configuração conhecida; os padrões de
+      limite só são usados para silos que nunca responderam.
+    """
+    def __init__(self, ttl: float, timeout: float, workers: int = 4):
+        self.ttl = ttl
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="silo-config")
+        self.entries = {}   # silo_id -> {"config", "etag", "fetched_at"}
+        self.pending = {}   # silo_id -> future da busca em andamento
+        self.lock = threading.Lock()
+
+    def _fetch(self, silo_id: int):
+        with self.lock:
+            entry = self.entries.get(silo_id)
+        headers = {"If-None-Match": entry["etag"]} if entry and entry.get("etag") else {}
+        try:
+            res = self.session.get(f"{SILO_API_URL}/{silo_id}", headers=headers, timeout=self.timeout)
+            if res.status_code == 304 and entry:
+                with self.lock:
+                    entry["fetched_at"] = time.time()
+                return
+            if res.status_code == 200:
+                silo_config = res.json()
+                with self.lock:
+                    self.entries[silo_id] = {
+                        "config": silo_config,
+                        "etag": res.headers.get("ETag"),
+                        "fetched_at": time.time(),
+                    }
+                print(f"ℹ Configuração carregada para Silo #{silo_id} (Temp Max: {silo_config.get('maxTemperature')})")
+                return
+            print(f" Falha ao buscar config do silo #{silo_id} ({res.status_code}), usando a última conhecida.")
+        except Exception as e:
+            print(f" Erro ao buscar config do silo #{silo_id}: {repr(e)}, usando a última conhecida.")
+        finally:
+            with self.lock:
+                self.pending.pop(silo_id, None)
+
+    def _refresh(self, silo_id: int):
+        """Agenda uma busca para o silo, se ainda não houver uma em andamento."""
+        with self.lock:
+            future = self.pending.get(silo_id)
+            if future is None:
+                future = self.pending[silo_id] = self.executor.submit(self._fetch, silo_id)
+        return future
+
+    def get_many(self, silo_ids) -> dict:
+        """Retorna {silo_id: config} para o ciclo; {} para silos que nunca responderam."""
+        now = time.time()
+        missing = []
+        for silo_id in silo_ids:
+            with self.lock:
+                entry = self.entries.get(silo_id)
+            if entry is None:
+                missing.append(self._refresh(silo_id))
+            elif now - entry["fetched_at"] >= self.ttl:
+                self._refresh(silo_id)
+        if missing:
+            futures_wait(missing, timeout=self.timeout * 2)
+        with self.lock:
+            return {silo_id: self.entries[silo_id]["config"] if silo_id in self.entries else {} for silo_id in silo_ids}
+
+
+silo_config_cache = SiloConfigCache(ttl=SILO_CONFIG_TTL, timeout=SILO_CONFIG_TIMEOUT)
 
 
 # LOOP PRINCIPAL
@@ -308,30 +478,29 @@ while True:
     start_time = datetime.utcnow()
     print(f"\n[{start_time}] Iniciando ciclo de processamento...")
 
-    device_keys = r.keys("device:history:*")
-    for device_key in device_keys:
-        device_id = device_key.split(":")[-1]
+    device_silos = {}
+    for device_id in devices_with_new_data(last_run):
         silo_id = DEVICE_TO_SILO.get(device_id)
         if not silo_id:
             print(f" {device_id} não mapeado para silo, ignorando...")
             continue
-            
-        # Buscar a configuração do silo
-        silo_config = {}
-        try:
-            res = requests.get(f"{SILO_API_URL}/{silo_id}")
-            if res.status_code == 200:
-                silo_config = res.json()
-                print(f"ℹ Configuração carregada para Silo #{silo_id} (Temp Max: {silo_config.get('maxTemperature')})")
-            else:
-                print(f" Falha ao buscar config do silo #{silo_id} ({res.status_code}), usando padrões.")
-        except Exception as e:
-            print(f" Erro ao buscar config do silo #{silo_id}: {repr(e)}, usando padrões.")
-            
-        # Processar dispositivo com configuração do silo
-        process_device(device_key, silo_id, last_run, silo_config)
-
-    last_run = int(time.time())
-    print("Ciclo concluído. Próximo em 5 minutos...")
+        device_silos[device_id] = silo_id
+
+    # Configuração de cada silo vinda do cache (TTL + revalidação em segundo plano)
+    silo_configs = silo_config_cache.get_many(set(device_silos.values()))
+
+    # O motor NumPy agrega por dispositivo: sem JVM, o custo por dispositivo é pequeno
+    cycle_ok = True
+    if CYCLE_MODE == "per_device" or AGGREGATION_ENGINE == "numpy":
+        for device_id, silo_id in device_silos.items():
+            process_device(f"device:history:{device_id}", silo_id, last_run, silo_configs[silo_id])
+    elif device_silos:
+        cycle_ok = process_cycle(device_silos, last_run, silo_configs)
+
+    if cycle_ok:
+        last_run = int(time.time())
+        print("Ciclo concluído. Próximo em 5 minutos...")
+    else:
+        print(" Ciclo com falha: as mesmas leituras serão reprocessadas no próximo ciclo.")
     print(" [keep-alive] Serviço ativo e aguardando novo ciclo.")
     time.sleep(PROCESS_INTERVAL)
@@ -0,0 +1,203 @@
+"""
+Leitura do layout compacto de histórico gravado pelo kafka-redis-consumer
+(HISTORY_LAYOUT=bucketed ou both) e dos rollups de 1 minuto e 1 hora.
+
+Cada chave device:ts:{device_id}:{bucket} contém registros de largura fixa
+(timestamp float64 + temperatura, umidade e mq_rs float32, little-endian).
+O formato precisa ser o mesmo de TS_RECORD em kafka-redis-consumer/consumer.py.
+"""
+
+import json
+import math
+import os
+import zlib
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:  # Opcional: só é necessário se o consumidor usar HISTORY_COMPRESSION=zstd
+    zstandard = None
+
+try:
+    from orjson import loads as json_loads
+except ImportError:  # Opcional: parser mais rápido para a decodificação em massa
+    json_loads = json.loads
+
+# Tamanho do bucket: deve ser igual ao HISTORY_BUCKET_SECONDS do consumidor
+HISTORY_BUCKET_SECONDS = int(os.getenv("HISTORY_BUCKET_SECONDS", 3600))
+
+TS_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    ("temperature", "<f4"),
+    ("humidity", "<f4"),
+    ("mq_rs", "<f4"),
+])
+
+
+def bucket_keys(device_id: str, start_ts: float, end_ts: float, bucket_seconds: int = HISTORY_BUCKET_SECONDS):
+    """Chaves dos buckets que cobrem o intervalo [start_ts, end_ts]."""
+    first = int(start_ts) - int(start_ts) % bucket_seconds
+    return [f"device:ts:{device_id}:{bucket}" for bucket in range(first, int(end_ts) + 1, bucket_seconds)]
+
+
+def read_range(redis_client, device_id: str, start_ts: float, end_ts: float,
+               bucket_seconds: int = HISTORY_BUCKET_SECONDS) -> np.ndarray:
+    """
+    Busca o intervalo em uma única ida ao Redis (MGET de todos os buckets) e
+    retorna um array estruturado (TS_DTYPE) ordenado por timestamp.
+
+    O cliente precisa ter decode_responses=False, pois os valores são binários.
+    Valores ausentes nas leituras vêm como NaN.
+    """
+    keys = bucket_keys(device_id, start_ts, end_ts, bucket_seconds)
+    chunks = [chunk for chunk in redis_client.mget(keys) if chunk]
+    if not chunks:
+        return np.empty(0, dtype=TS_DTYPE)
+
+    records = np.frombuffer(b"".join(chunks), dtype=TS_DTYPE)
+    records = records[(records["timestamp"] >= start_ts) & (records["timestamp"] <= end_ts)]
+    # APPEND grava na ordem de chegada; a ordem temporal é garantida aqui
+    return records[np.argsort(records["timestamp"], kind="stable")]
+
+
+def read_range_columns(redis_client, device_id: str, start_ts: float, end_ts: float,
+                       bucket_seconds: int = HISTORY_BUCKET_SECONDS) -> dict:
+    """Mesmo que read_range, mas retorna um dict de arrays NumPy por coluna."""
+    records = read_range(redis_client, device_id, start_ts, end_ts, bucket_seconds)
+    return {name: records[name] for name in TS_DTYPE.names}
+
+
+# Membros comprimidos do histórico (HISTORY_COMPRESSION no consumidor). O cabeçalho e o
+# dicionário precisam ser os mesmos de HistoryCodec em kafka-redis-consumer/consumer.py.
+CODEC_ZLIB = 0x01
+CODEC_ZSTD = 0x02
+HISTORY_DICTIONARY = (
+    b'{"device_id": "0C4EA065A598", "payload": {"temperature": 24.5, "humidity": 65.2, '
+    b'"mq_rs": 1234.5}, "timestamp": 1700000000}'
+)
+HISTORY_ZSTD_DICT = os.getenv("HISTORY_ZSTD_DICT")
+_zstd_decompressor = None
+
+
+def _zstd():
+    global _zstd_decompressor
+    if _zstd_decompressor is None:
+        if HISTORY_ZSTD_DICT:
+            with open(HISTORY_ZSTD_DICT, "rb") as f:
+                dict_data = zstandard.ZstdCompressionDict(f.read())
+        else:
+            dict_data = zstandard.ZstdCompressionDict(HISTORY_DICTIONARY, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+        _zstd_decompressor = zstandard.ZstdDecompressor(dict_data=dict_data, format=zstandard.FORMAT_ZSTD1_MAGICLESS)
+    return _zstd_decompressor
+
+
+def decode_member(raw) -> dict:
+    """
+    Decodifica um membro de device:history:{id}, comprimido ou não.
+    Membros comprimidos são binários: o cliente precisa ter decode_responses=False.
+    """
+    if isinstance(raw, str):
+        return json.loads(raw)
+    codec = raw[0]
+    if codec == CODEC_ZLIB:
+        decompressor = zlib.decompressobj(-15, zdict=HISTORY_DICTIONARY)
+        raw = decompressor.decompress(raw[1:]) + decompressor.flush()
+    elif codec == CODEC_ZSTD:
+        # Sem o tamanho no frame: o limite cobre com folga uma mensagem de sensor
+        raw = _zstd().decompress(raw[1:], max_output_size=1 << 20)
+    return json_loads(raw)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def decode_members(raw_members) -> dict:
+    """
+    Decodifica, em uma passada, o resultado de um zrangebyscore do histórico em
+    arrays NumPy por coluna: timestamp (int64), temperature, humidity e mq_rs
+    (float64, NaN quando ausente ou inválido). Payloads gravados como string JSON
+    também são aceitos. Registros sem timestamp são descartados.
+    """
+    n = len(raw_members)
+    timestamps = np.full(n, np.nan)
+    values = {field: np.full(n, np.nan) for field in ROLLUP_FIELDS}
+    for i, raw in enumerate(raw_members):
+        record = decode_member(raw)
+        payload = record.get("payload")
+        if isinstance(payload, str):
+            try:
+                payload = json_loads(payload)
+            except ValueError:
+                payload = None
+        if not isinstance(payload, dict):
+            payload = {}
+        timestamps[i] = _to_float(record.get("timestamp"))
+        for field, column in values.items():
+            column[i] = _to_float(payload.get(field))
+
+    valid = ~np.isnan(timestamps)
+    columns = {field: column[valid] for field, column in values.items()}
+    columns["timestamp"] = timestamps[valid].astype(np.int64)
+    return columns
+
+
+def mq135_to_co2_ppm_array(rs: np.ndarray, r0: float = 1040) -> np.ndarray:
+    """
+    Converte a resistência Rs (ohms) do MQ135 em CO2 (ppm aproximado), de forma
+    vetorizada. Curva empírica de datasheet: ppm = 10 ** ((log10(Rs/R0) - 1.92) / -0.42).
+    Rs ausente ou <= 0 resulta em NaN. O arredondamento em 2 casas é o do
+    np.round (metade para o par sobre o valor escalado), que pode diferir do
+    round() do Python em valores terminados exatamente em 5 na terceira casa.
+    """
+    rs = np.asarray(rs, dtype=np.float64)
+    valid = rs > 0
+    ppm = np.full(rs.shape, np.nan)
+    with np.errstate(over="ignore"):
+        ppm[valid] = np.power(10.0, (np.log10(rs[valid] / r0) - 1.92) / -0.42)
+    ppm[~np.isfinite(ppm)] = np.nan
+    return np.round(ppm, 2)
+
+
+# Níveis de rollup mantidos pelo consumidor: nome -> tamanho do bucket em segundos
+ROLLUP_TIERS = {"1m": 60, "1h": 3600}
+ROLLUP_FIELDS = ("temperature", "humidity", "mq_rs")
+
+
+def read_rollups(redis_client, device_id: str, tier: str, start_ts: float, end_ts: float) -> list:
+    """
+    Lê os rollups de um nível (device:rollup:{tier}:{device_id}:{bucket}) no
+    intervalo, com um único pipeline de HGETALL. Retorna, por bucket, count,
+    avg, std (amostral), min e max de cada métrica; buckets vazios são omitidos.
+    """
+    bucket_seconds = ROLLUP_TIERS[tier]
+    first = int(start_ts) - int(start_ts) % bucket_seconds
+    buckets = list(range(first, int(end_ts) + 1, bucket_seconds))
+    pipe = redis_client.pipeline(transaction=False)
+    for bucket in buckets:
+        pipe.hgetall(f"device:rollup:{tier}:{device_id}:{bucket}")
+
+    rows = []
+    for bucket, raw in zip(buckets, pipe.execute()):
+        if not raw:
+            continue
+        raw = {(k.decode() if isinstance(k, bytes) else k): float(v) for k, v in raw.items()}
+        row = {"bucket": bucket}
+        for field in ROLLUP_FIELDS:
+            count = raw.get(f"{field}:count")
+            if not count:
+                continue
+            mean = raw[f"{field}:sum"] / count
+            variance = (raw[f"{field}:sumsq"] - count * mean * mean) / (count - 1) if count > 1 else None
+            row[field] = {
+                "count": int(count),
+                "avg": mean,
+                "std": math.sqrt(max(variance, 0.0)) if variance is not None else None,
+                "min": raw[f"{field}:min"],
+                "max": raw[f"{field}:max"],
+            }
+        rows.append(row)
+    return rows